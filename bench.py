@@ -0,0 +1,858 @@
+import argparse
+import asyncio
+import csv
+import importlib.util
+import json
+import os
+import random
+import resource
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import count
+
+from telegram import CallbackQuery, Chat, Message, Update, User
+from telegram.ext import SimpleUpdateProcessor
+from telegram.request import BaseRequest
+
+
+def load_bot():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main(UPD2).py")
+    spec = importlib.util.spec_from_file_location("organizer_bot", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def make_callback_update(update_id: int, user_id: int, data: str, message_id: int = 1) -> Update:
+    user = User(user_id, f"user{user_id}", False)
+    message = Message(message_id, datetime.now(), Chat(user_id, Chat.PRIVATE))
+    query = CallbackQuery(str(update_id), user, str(user_id), message=message, data=data)
+    return Update(update_id, callback_query=query)
+
+
+async def run_admission_scenario(processor, flood: bool, duration: float, users: int,
+                                 handler_time: float, cpu_time: float, flood_rate: int) -> list:
+    latencies = []
+    update_ids = iter(range(1, 10 ** 9))
+    tasks = set()
+
+    async def handler(started: float, record: bool):
+        spin_until = time.perf_counter() + cpu_time
+        while time.perf_counter() < spin_until:
+            pass
+        await asyncio.sleep(handler_time)
+        if record:
+            latencies.append(time.perf_counter() - started)
+
+    def submit(user_id: int, data: str, record: bool):
+        update = make_callback_update(next(update_ids), user_id, data)
+        task = asyncio.create_task(processor.process_update(update, handler(time.perf_counter(), record)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def well_behaved_user(user_id: int):
+        rng = random.Random(user_id)
+        await asyncio.sleep(rng.random())
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            submit(user_id, rng.choice(['tasks', 'list_tasks', 'expenses']), True)
+            await asyncio.sleep(1.5 + rng.random())
+
+    async def flooder():
+        deadline = time.perf_counter() + duration
+        n = 0
+        while time.perf_counter() < deadline:
+            for _ in range(flood_rate // 100):
+                n += 1
+                submit(10 ** 6 + n % 50, 'list_tasks' if n % 2 else f'list_tasks:{n}', False)
+            await asyncio.sleep(0.01)
+
+    runners = [well_behaved_user(1000 + i) for i in range(users)]
+    if flood:
+        runners.append(flooder())
+    await asyncio.gather(*runners)
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+def bench_admission(args) -> None:
+    bot = load_bot()
+    scenarios = [
+        ("no flood, admission", bot.AdmissionUpdateProcessor, False),
+        ("flood, no admission", lambda: SimpleUpdateProcessor(bot.MAX_CONCURRENT_UPDATES), True),
+        ("flood, admission", bot.AdmissionUpdateProcessor, True),
+    ]
+    print(f"{'scenario':<22}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  counters")
+    for name, factory, flood in scenarios:
+        processor = factory()
+        latencies = asyncio.run(run_admission_scenario(
+            processor, flood, args.duration, args.users, args.handler_ms / 1000, args.cpu_ms / 1000, args.flood_rate
+        ))
+        counters = getattr(processor, 'stats', {})
+        print(f"{name:<22}{len(latencies):>6}"
+              f"{percentile(latencies, 0.5) * 1000:>10.1f}"
+              f"{percentile(latencies, 0.95) * 1000:>10.1f}"
+              f"{percentile(latencies, 0.99) * 1000:>10.1f}  {counters}")
+
+
+def bench_parse(args) -> None:
+    bot = load_bot()
+    timezone = bot.TIMEZONE
+
+    def strptime_path(text):
+        return timezone.localize(datetime.strptime(text, "%d.%m.%Y %H:%M"))
+
+    cases = [
+        ("strptime + localize", strptime_path, "19.10.2026 14:30"),
+        ("parse_datetime_input", bot.parse_datetime_input, "19.10.2026 14:30"),
+        ("parse_datetime_input", bot.parse_datetime_input, "завтра 9:00"),
+        ("parse_datetime_input", bot.parse_datetime_input, "через 2 часа"),
+        ("parse_datetime_input", bot.parse_datetime_input, "+30m"),
+        ("float(replace)", lambda text: float(text.replace(',', '.')), "1250,50"),
+        ("parse_amount", bot.parse_amount, "1250,50"),
+        ("isdigit + int", lambda text: int(text) if text.isdigit() and 1 <= int(text) <= 5 else None, "3"),
+        ("parse_priority", bot.parse_priority, "3"),
+    ]
+    print(f"{'parser':<24}{'input':<20}{'ns/op':>10}")
+    for name, func, text in cases:
+        per_call = min(timeit.repeat(lambda: func(text), number=args.number, repeat=5)) / args.number
+        print(f"{name:<24}{text:<20}{per_call * 1e9:>10.0f}")
+
+
+SEARCH_WORDS = ["купить", "молоко", "отчет", "встреча", "проект", "позвонить", "маме", "оплатить",
+                "счет", "интернет", "книга", "прочитать", "спорт", "зал", "врач", "запись", "подарок",
+                "идея", "статья", "ремонт", "машина", "отпуск", "билеты", "план", "неделя"]
+
+
+def seed_search_storage(bot, users: int, items: int, rng: random.Random) -> None:
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    bot.DB_NAME = path
+    bot.init_db()
+    bot.storage = bot.SQLiteStorage(path)
+    for user_id in range(1, users + 1):
+        for _ in range(items):
+            text = " ".join(rng.choice(SEARCH_WORDS) for _ in range(rng.randint(3, 8)))
+            if rng.random() < 0.5:
+                bot.storage.add_note(user_id, text, rng.choice(SEARCH_WORDS))
+            else:
+                bot.storage.add_task(user_id, text, rng.randint(1, 5), None, user_id)
+
+
+async def run_inline_scenario(search, duration: float, users: int, keystroke_ms: float,
+                              rng: random.Random) -> tuple:
+    latencies, cold = [], []
+    superseded = 0
+    tasks = set()
+    warmed = set()
+
+    async def keystroke(user_id: int, text: str, started: float):
+        nonlocal superseded
+        first = user_id not in warmed
+        warmed.add(user_id)
+        results = await search(user_id, text)
+        if results is None:
+            superseded += 1
+        else:
+            (cold if first else latencies).append(time.perf_counter() - started)
+
+    async def typist(user_id: int):
+        await asyncio.sleep(rng.random())
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            phrase = " ".join(rng.choice(SEARCH_WORDS) for _ in range(rng.randint(1, 2)))
+            for end in range(1, len(phrase) + 1):
+                # timed from the keystroke, so time spent queued behind a blocked loop counts too
+                task = asyncio.ensure_future(keystroke(user_id, phrase[:end], time.perf_counter()))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                await asyncio.sleep(rng.expovariate(1000 / keystroke_ms))
+            await asyncio.sleep(rng.uniform(0.5, 1.5))
+
+    await asyncio.gather(*(typist(user_id) for user_id in range(1, users + 1)))
+    await asyncio.gather(*tasks)
+    return latencies, cold, superseded
+
+
+def bench_inline(args) -> None:
+    bot = load_bot()
+    seed_search_storage(bot, args.users, args.items, random.Random(args.seed))
+
+    async def linear_scan(user_id, text):
+        words = text.lower().split()
+        notes = bot.storage.get_notes(user_id, bot.INLINE_NOTES_LIMIT)
+        tasks = bot.storage.get_tasks(user_id)
+        return [item for item in [n.text for n in notes] + [t.task for t in tasks]
+                if all(word in item for word in words)][:bot.INLINE_RESULTS_LIMIT]
+
+    scenarios = [
+        ("linear scan", lambda: linear_scan),
+        ("prefix index", lambda: bot.SearchIndex().search),
+    ]
+    print(f"{'scenario':<16}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'cold p50':>10}"
+          f"  superseded  counters")
+    for name, factory in scenarios:
+        search = factory()
+        latencies, cold, superseded = asyncio.run(run_inline_scenario(
+            search, args.duration, args.users, args.keystroke_ms, random.Random(args.seed)
+        ))
+        counters = getattr(getattr(search, '__self__', None), 'stats', {})
+        print(f"{name:<16}{len(latencies):>7}"
+              f"{percentile(latencies, 0.5) * 1000:>10.2f}"
+              f"{percentile(latencies, 0.95) * 1000:>10.2f}"
+              f"{percentile(latencies, 0.99) * 1000:>10.2f}"
+              f"{percentile(cold, 0.5) * 1000:>10.2f}  {superseded:>10}  {counters}")
+
+
+def delivery_worker(args) -> None:
+    bot = load_bot()
+    bot.DB_NAME = args.db
+    bot.storage = bot.SQLiteStorage(args.db)
+    bot.LEASE_TTL = timedelta(seconds=args.lease_ttl)
+    bot.LEASE_RENEW_INTERVAL = timedelta(seconds=args.lease_ttl / 5)
+    bot.REMINDER_CLAIM_TIMEOUT = timedelta(seconds=args.claim_timeout)
+    bot.CATCH_UP_INTERVAL = bot.CATCH_UP_DELAY = timedelta(seconds=1)
+    request = LoopbackRequest(args.send_ms / 1000, sink=args.sink, name=args.name)
+    application = bot.build_application(request)
+    application.bot_data['sender'] = bot.RateLimitedSender(application.bot, args.send_rate)
+    application.run_polling(stop_signals=None)
+
+
+def bench_delivery(args) -> None:
+    """Deliver reminders across a SIGKILL and a graceful handoff; exit 1 on any loss or unexplained duplicate.
+
+    Worker A runs the real application: overdue reminders go through the catch-up
+    job, the rest fire as scheduled jobs. A is SIGKILLed mid-burst; B waits for A's
+    lease to expire and takes over, then C asks B for a handoff. Only reminders A
+    sent but had not yet deleted when it died may be sent twice, which is the
+    documented crash window of deliver_reminder().
+    """
+    bot = load_bot()
+    workdir = tempfile.mkdtemp()
+    db, sink = os.path.join(workdir, "bench.db"), os.path.join(workdir, "sent.txt")
+    bot.DB_NAME = db
+    bot.init_db()
+    storage = bot.SQLiteStorage(db)
+    now = datetime.now(bot.TIMEZONE)
+    overdue = args.reminders // 3
+    for number in range(args.reminders):
+        if number < overdue:
+            trigger_time = now - timedelta(minutes=5)
+        else:
+            trigger_time = now + timedelta(seconds=2 + args.spread * (number - overdue) / (args.reminders - overdue))
+        storage.add_reminder(number % 100 + 1, str(number), trigger_time)
+
+    def worker(name: str) -> subprocess.Popen:
+        command = [sys.executable, os.path.abspath(__file__), 'delivery-worker', '--db', db, '--sink', sink,
+                   '--name', name, '--send-ms', str(args.send_ms), '--send-rate', str(args.send_rate),
+                   '--lease-ttl', str(args.lease_ttl), '--claim-timeout', str(args.claim_timeout)]
+        log = open(os.path.join(workdir, f"{name}.log"), 'w')
+        return subprocess.Popen(command, cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+
+    def sent() -> list:
+        if not os.path.exists(sink):
+            return []
+        with open(sink, encoding='utf-8') as f:
+            return [line.split() for line in f if line.strip()]
+
+    def wait_for(condition, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if condition():
+                return True
+            time.sleep(0.05)
+        return False
+
+    def remaining() -> set:
+        conn = sqlite3.connect(db)
+        result = {row[0] for row in conn.execute("SELECT text FROM reminders")}
+        conn.close()
+        return result
+
+    failures = []
+    first = worker("A")
+    if not wait_for(lambda: len(sent()) >= args.kill_after, 30):
+        failures.append(f"A sent only {len(sent())} reminders")
+    first.send_signal(signal.SIGKILL)
+    first.wait()
+    # sent but still in the table: killed between the send and the delete
+    crash_window = {number for name, number in sent() if name == "A"} & remaining()
+    killed_at = len(sent())
+
+    second = worker("B")
+    if not wait_for(lambda: sum(1 for name, _ in sent() if name == "B") >= args.handoff_after, 30):
+        failures.append("B never took over after A was killed")
+    third = worker("C")
+    try:
+        second.wait(timeout=30)
+        if second.returncode != 0:
+            failures.append(f"B exited with {second.returncode} after the handoff")
+    except subprocess.TimeoutExpired:
+        second.kill()
+        failures.append("B did not hand off to C")
+    if not wait_for(lambda: not remaining(), 30 + args.spread):
+        failures.append(f"{len(remaining())} reminders still in the table")
+    third.send_signal(signal.SIGTERM)
+    third.wait(timeout=30)
+
+    counts = Counter(number for _, number in sent())
+    by_worker = Counter(name for name, _ in sent())
+    expected = {str(number) for number in range(args.reminders)}
+    lost = expected - set(counts)
+    duplicated = {number for number, total in counts.items() if total > 1}
+    unexplained = {number for number in duplicated if number not in crash_window or counts[number] > 2}
+    fired = Counter()
+    events = os.path.join(workdir, "events.jsonl")
+    if os.path.exists(events):
+        with open(events, encoding='utf-8') as f:
+            fired.update(event.get('source') for event in map(json.loads, f) if event['event'] == 'reminder_fired')
+
+    print(f"reminders: {args.reminders} ({overdue} overdue), sent by worker: {dict(by_worker)}, "
+          f"SIGKILL after {killed_at}")
+    print(f"delivered once: {sum(1 for number in expected if counts[number] == 1)}, "
+          f"duplicated: {len(duplicated)} (crash window {len(crash_window)}), lost: {len(lost)}, "
+          f"fired after the kill by source: {dict(fired)}")
+    if lost:
+        failures.append(f"lost: {sorted(lost, key=int)[:20]}")
+    if unexplained:
+        failures.append(f"duplicated outside the crash window: {sorted(unexplained, key=int)[:20]}")
+    for source in ('job', 'catch_up'):
+        if not fired[source]:
+            failures.append(f"no reminders fired through {source} after the kill")
+    for failure in failures:
+        print("FAIL", failure)
+    if failures:
+        print(f"worker logs in {workdir}")
+        sys.exit(1)
+
+
+def check_item_actions(args) -> None:
+    bot = load_bot()
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    bot.DB_NAME = path
+    bot.init_db()
+    storage = bot.SQLiteStorage(path)
+    for user_id in range(1, args.users + 1):
+        for number in range(args.items):
+            storage.add_task(user_id, f"task {number}", 3, None, user_id)
+            storage.add_expense(user_id, 100 + number, "Еда")
+            storage.add_note(user_id, f"note {number}", "tag")
+    connect = sqlite3.connect
+
+    def rows(table: str) -> dict:
+        conn = connect(path)
+        result = {row[0]: row for row in conn.execute(f"SELECT * FROM {table}")}
+        conn.close()
+        return result
+
+    def plan(sql: str) -> list:
+        conn = connect(path)
+        result = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+        conn.close()
+        return result
+
+    actions = [
+        ('tasks', "complete", storage.complete_task),
+        ('tasks', "update", lambda owner, item_id: storage.update_task(owner, item_id, "edited")),
+        ('tasks', "delete", storage.delete_task),
+        ('expenses', "update", lambda owner, item_id: storage.update_expense(owner, item_id, 1.5)),
+        ('expenses', "delete", storage.delete_expense),
+        ('notes', "update", lambda owner, item_id: storage.update_note(owner, item_id, "edited")),
+        ('notes', "delete", storage.delete_note),
+    ]
+    statements = []
+
+    def traced_connect(*connect_args, **kwargs):
+        conn = connect(*connect_args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    failures = []
+    bot.sqlite3.connect = traced_connect
+    try:
+        for table, action, func in actions:
+            owner, item_id = next((row[1], row[0]) for row in rows(table).values()
+                                  if table != 'tasks' or not row[6])
+            before = rows(table)
+            statements.clear()
+            foreign = func(owner + 1, item_id)
+            if foreign or rows(table) != before:
+                failures.append(f"{table} {action}: another user's call changed item {item_id}")
+            statements.clear()
+            done = func(owner, item_id)
+            after = rows(table)
+            touched = [key for key in before.keys() | after.keys() if before.get(key) != after.get(key)]
+            if not done or touched != [item_id]:
+                failures.append(f"{table} {action}: returned {done}, touched rows {touched}")
+            for sql in statements:
+                if not sql.startswith(("SELECT", "UPDATE", "DELETE")):
+                    continue
+                details = plan(sql)
+                # budget_totals has a composite primary key, which SQLite serves from sqlite_autoindex_*
+                if not any(key in d for d in details
+                           for key in ("USING INTEGER PRIMARY KEY", "USING PRIMARY KEY", "sqlite_autoindex_")):
+                    failures.append(f"{table} {action}: {sql!r} -> {details}")
+            print(f"{table:<10}{action:<10}{len(touched)} row, {len(statements)} statements")
+    finally:
+        bot.sqlite3.connect = connect
+
+    for failure in failures:
+        print("FAIL", failure)
+    if failures:
+        sys.exit(1)
+
+
+def python_analytics(amounts: list, created: list, categories: list, category_count: int,
+                     first_day: int, last_day: int, window: int) -> tuple:
+    ordered = sorted(amounts)
+    percentiles = [ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))] for q in (50, 90, 99)]
+    daily = [0.0] * (last_day - first_day + 1)
+    shares = [0.0] * category_count
+    for amount, when, category in zip(amounts, created, categories):
+        daily[when // 86400 - first_day] += amount
+        shares[category] += amount
+    total = sum(shares)
+    shares = [share / total for share in shares]
+    average, running = [], 0.0
+    for day, value in enumerate(daily):
+        running += value
+        if day >= window:
+            running -= daily[day - window]
+        if day >= window - 1:
+            average.append(running / window)
+    return percentiles, average, shares
+
+
+def numpy_analytics(bot, columns, first_day: int, last_day: int, window: int) -> tuple:
+    percentiles = bot.np.percentile(columns.amount, (50, 90, 99))
+    average = bot.moving_average(bot.daily_totals(columns, first_day, last_day), window)
+    shares = bot.np.bincount(columns.category, weights=columns.amount, minlength=len(columns.categories))
+    return percentiles, average, shares / shares.sum()
+
+
+def bench_analytics(args) -> None:
+    bot = load_bot()
+    np = bot.np
+    rng = np.random.default_rng(args.seed)
+    last_day = bot.local_seconds(datetime.now(bot.TIMEZONE)) // 86400
+    first_day = last_day - args.days + 1
+    created = np.sort(rng.integers(first_day * 86400, (last_day + 1) * 86400, args.rows, dtype=np.int64))
+    columns = bot.ExpenseColumns(
+        np.round(rng.lognormal(6, 1, args.rows), 2), created,
+        rng.integers(0, args.categories, args.rows, dtype=np.int32),
+        [f"category{code}" for code in range(args.categories)],
+        np.zeros(args.rows, dtype=np.int32), [bot.DEFAULT_CURRENCY]
+    )
+    lists = (columns.amount.tolist(), columns.created.tolist(), columns.category.tolist())
+
+    started = time.perf_counter()
+    numpy_result = numpy_analytics(bot, columns, first_day, last_day, args.window)
+    numpy_time = time.perf_counter() - started
+    started = time.perf_counter()
+    python_result = python_analytics(*lists, args.categories, first_day, last_day, args.window)
+    python_time = time.perf_counter() - started
+
+    drift = max(abs(a - b) for a, b in zip(numpy_result[1][-10:], python_result[1][-10:]))
+    print(f"{args.rows} expenses over {args.days} days, {args.categories} categories")
+    print(f"{'pure Python':<14}{python_time:>9.2f}s")
+    print(f"{'NumPy':<14}{numpy_time:>9.2f}s  ({python_time / numpy_time:.0f}x), "
+          f"moving average drift {drift:.2e}")
+
+    if args.load_rows:
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        bot.DB_NAME = path
+        bot.init_db()
+        storage = bot.SQLiteStorage(path)
+        conn = bot.sqlite3.connect(path)
+        conn.executemany(
+            "INSERT INTO expenses (user_id, amount, category, created) VALUES (1, ?, ?, datetime(?, 'unixepoch'))",
+            zip(lists[0][:args.load_rows], (f"category{code}" for code in lists[2]), lists[1][:args.load_rows])
+        )
+        conn.commit()
+        conn.close()
+        started = time.perf_counter()
+        expenses = storage.get_expenses(1, args.load_rows)
+        tuples_time = time.perf_counter() - started
+        started = time.perf_counter()
+        loaded = storage.get_expense_columns(1)
+        columns_time = time.perf_counter() - started
+        print(f"\nloading {len(loaded.amount)} rows from SQLite: "
+              f"get_expenses {tuples_time:.2f}s ({len(expenses)} Expense tuples), "
+              f"get_expense_columns {columns_time:.2f}s")
+
+
+LOAD_MENUS = ['tasks', 'expenses', 'notes', 'reminders', 'main_menu']
+LOAD_LISTS = ['list_tasks', 'list_expenses', 'list_notes', 'list_reminders', 'list_budgets',
+              't:p:1', 'e:p:1', 'n:p:1']
+LOAD_CATEGORIES = ["Еда", "Транспорт", "Кафе", "Дом", "Связь", "Здоровье", "Подарки", "Одежда"]
+LOAD_CSV_FIELDS = ['storage', 'rate', 'actions', 'updates', 'shed', 'elapsed_s', 'throughput', 'p50_ms', 'p99_ms',
+                   'cpu_percent', 'rss_mb', 'max_rss_mb']
+
+
+class LoopbackRequest(BaseRequest):
+    """Answers every Bot API call locally, after latency seconds, the way the Telegram server would.
+
+    With a sink, every sendMessage is appended to it as "<name> <last word of the text>".
+    """
+
+    def __init__(self, latency: float, sink: str = None, name: str = ""):
+        self.latency = latency
+        self.calls = Counter()
+        self.sink = open(sink, 'a', encoding='utf-8') if sink else None
+        self.name = name
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def do_request(self, url: str, method: str, request_data=None, **timeouts) -> tuple:
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        parameters = request_data.parameters if request_data is not None else {}
+        if endpoint == 'sendMessage' and self.sink is not None:
+            self.sink.write(f"{self.name} {parameters['text'].rsplit(' ', 1)[-1]}\n")
+            self.sink.flush()
+        if endpoint == 'getUpdates':
+            await asyncio.sleep(0.2)
+            result = []
+        elif endpoint == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': "bench", 'username': "bench_bot"}
+        elif endpoint.startswith(('send', 'edit')):
+            result = {'message_id': 1, 'date': int(time.time()), 'text': parameters.get('text', ""),
+                      'chat': {'id': int(parameters.get('chat_id', 1)), 'type': 'private'}}
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+def seed_load_database(bot, path: str, args, rng: random.Random) -> None:
+    now = datetime.now(bot.TIMEZONE)
+    conn = bot.sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous=OFF")
+
+    def words(low: int, high: int) -> str:
+        return " ".join(rng.choice(SEARCH_WORDS) for _ in range(rng.randint(low, high)))
+
+    def past() -> str:
+        return bot.format_db_datetime(now - timedelta(seconds=rng.randrange(90 * 86400)))
+
+    def future() -> str:
+        return bot.format_db_datetime(now + timedelta(seconds=rng.randrange(3600, 30 * 86400)))
+
+    for user_id in range(1, args.users + 1):
+        conn.executemany(
+            "INSERT INTO tasks (user_id, task, priority, created, due, completed, chat_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(user_id, words(2, 6), rng.randint(1, 5), past(), future() if rng.random() < 0.5 else None,
+              rng.random() < 0.3, user_id) for _ in range(args.tasks)]
+        )
+        conn.executemany(
+            "INSERT INTO expenses (user_id, amount, category, created) VALUES (?, ?, ?, ?)",
+            [(user_id, round(rng.lognormvariate(6, 1), 2), rng.choice(LOAD_CATEGORIES), past())
+             for _ in range(args.expenses)]
+        )
+        conn.executemany(
+            "INSERT INTO notes (user_id, text, tags, created) VALUES (?, ?, ?, ?)",
+            [(user_id, words(5, 30), rng.choice(SEARCH_WORDS) if rng.random() < 0.5 else None, past())
+             for _ in range(args.notes)]
+        )
+        conn.executemany(
+            "INSERT INTO reminders (id, user_id, text, trigger_time, chat_id) VALUES (?, ?, ?, ?, ?)",
+            [(f"load-{user_id}-{number}", user_id, words(2, 5), future(), user_id)
+             for number in range(args.reminders)]
+        )
+    conn.commit()
+    conn.close()
+
+
+def seed_memory_storage(bot, storage, args, rng: random.Random) -> None:
+    """The same data as seed_load_database(), through the Storage API, for --storage memory."""
+    now = datetime.now(bot.TIMEZONE)
+
+    def words(low: int, high: int) -> str:
+        return " ".join(rng.choice(SEARCH_WORDS) for _ in range(rng.randint(low, high)))
+
+    for user_id in range(1, args.users + 1):
+        for _ in range(args.tasks):
+            due = now + timedelta(seconds=rng.randrange(3600, 30 * 86400)) if rng.random() < 0.5 else None
+            task_id = storage.add_task(user_id, words(2, 6), rng.randint(1, 5), due, user_id)
+            if rng.random() < 0.3:
+                storage.complete_task(user_id, task_id)
+        for _ in range(args.expenses):
+            storage.add_expense(user_id, round(rng.lognormvariate(6, 1), 2), rng.choice(LOAD_CATEGORIES))
+        for _ in range(args.notes):
+            storage.add_note(user_id, words(5, 30), rng.choice(SEARCH_WORDS) if rng.random() < 0.5 else None)
+        for _ in range(args.reminders):
+            storage.add_reminder(user_id, words(2, 5), now + timedelta(seconds=rng.randrange(3600, 30 * 86400)),
+                                 user_id)
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in ('menu', 'list', 'flow'):
+            raise argparse.ArgumentTypeError(f"unknown action {kind!r}, expected menu, list or flow")
+        mix[kind] = float(weight)
+    return mix
+
+
+def load_action(kind: str, rng: random.Random) -> list:
+    """One user action as the (update kind, payload) steps a client would send in a row."""
+    if kind == 'menu':
+        return [('callback', rng.choice(LOAD_MENUS))]
+    if kind == 'list':
+        return [('callback', rng.choice(LOAD_LISTS))]
+    text = " ".join(rng.choice(SEARCH_WORDS) for _ in range(rng.randint(2, 6)))
+    return rng.choice([
+        [('callback', 'add_task'), ('message', text), ('message', str(rng.randint(1, 5))), ('message', "завтра 9:00")],
+        [('callback', 'add_expense'), ('message', f"{rng.randint(50, 5000)}"), ('message', rng.choice(LOAD_CATEGORIES))],
+        [('callback', 'add_note'), ('message', text), ('message', "нет")],
+        [('callback', 'add_reminder'), ('message', text), ('message', "через 2 часа")],
+    ])
+
+
+def load_schedule(rate: float, duration: float, users: int, mix: dict, rng: random.Random) -> list:
+    """Poisson arrivals at rate actions/s: (offset, user_id, steps), fixed by the seed."""
+    kinds, weights = list(mix), list(mix.values())
+    schedule = []
+    at = rng.expovariate(rate)
+    while at < duration:
+        schedule.append((at, rng.randint(1, users), load_action(rng.choices(kinds, weights)[0], rng)))
+        at += rng.expovariate(rate)
+    return schedule
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return 0.0
+
+
+async def run_load_step(application, schedule: list, users: int) -> dict:
+    """Replay one schedule open-loop; latency is counted from the scheduled arrival, not the send."""
+    latencies = []
+    shed = 0
+    busy = set()
+    tasks = set()
+    update_ids = count(1)
+
+    def make_update(user_id: int, kind: str, payload: str) -> Update:
+        update_id = next(update_ids)
+        user = {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}"}
+        message = {'message_id': update_id, 'date': int(time.time()), 'chat': {'id': user_id, 'type': 'private'}}
+        if kind == 'callback':
+            message['from'] = {'id': 1, 'is_bot': True, 'first_name': "bench"}
+            data = {'callback_query': {'id': str(update_id), 'from': user, 'chat_instance': str(user_id),
+                                       'data': payload, 'message': message}}
+        else:
+            data = {'message': dict(message, text=payload, **{'from': user})}
+        return Update.de_json(dict(data, update_id=update_id), application.bot)
+
+    async def dispatch(update: Update) -> bool:
+        handled = False
+
+        async def handle():
+            nonlocal handled
+            handled = True
+            await application.process_update(update)
+
+        await application.update_processor.process_update(update, handle())
+        return handled
+
+    async def act(user_id: int, steps: list, arrival: float):
+        nonlocal shed
+        try:
+            for kind, payload in steps:
+                if not await dispatch(make_update(user_id, kind, payload)):
+                    shed += 1
+                    return
+                latencies.append(time.perf_counter() - arrival)
+                arrival = time.perf_counter()
+        finally:
+            busy.discard(user_id)
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = usage.ru_utime + usage.ru_stime
+    started = time.perf_counter()
+    for offset, user_id, steps in schedule:
+        delay = started + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        # a client finishes one action before starting the next, so collisions go to the next idle user
+        while user_id in busy:
+            user_id = user_id % users + 1
+        busy.add(user_id)
+        task = asyncio.create_task(act(user_id, steps, started + offset))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    return {
+        'actions': len(schedule),
+        'updates': len(latencies),
+        'shed': shed,
+        'elapsed_s': round(elapsed, 2),
+        'throughput': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'cpu_percent': round((usage.ru_utime + usage.ru_stime - cpu) / elapsed * 100, 1),
+        'rss_mb': round(rss_mb(), 1),
+        'max_rss_mb': round(usage.ru_maxrss / 1024, 1),
+    }
+
+
+def bench_load(args) -> None:
+    bot = load_bot()
+    started = time.perf_counter()
+    if args.storage == 'memory':
+        # same handlers and data without disk I/O, to separate Python overhead from SQLite
+        bot.storage = bot.MemoryStorage()
+        seed_memory_storage(bot, bot.storage, args, random.Random(args.seed))
+    else:
+        path = args.db or os.path.join(tempfile.mkdtemp(), "bench.db")
+        bot.DB_NAME = path
+        bot.init_db()
+        bot.storage = bot.SQLiteStorage(path)
+        conn = bot.sqlite3.connect(path)
+        seeded = conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+        conn.close()
+        if seeded and not args.reuse:
+            sys.exit(f"{path} already has {seeded} tasks; pass --reuse to load-test against it as is")
+        if not seeded:
+            seed_load_database(bot, path, args, random.Random(args.seed))
+    print(f"{args.storage}: seeded {args.users} users in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    request = LoopbackRequest(args.api_ms / 1000)
+    application = bot.build_application(request)
+    out = open(args.csv, 'w', newline='') if args.csv else sys.stdout
+    writer = csv.DictWriter(out, LOAD_CSV_FIELDS)
+    writer.writeheader()
+
+    async def run():
+        await application.initialize()
+        try:
+            for rate in args.rates:
+                schedule = load_schedule(rate, args.duration, args.users, args.mix, random.Random(f"{args.seed}:{rate}"))
+                row = await run_load_step(application, schedule, args.users)
+                writer.writerow(dict(row, storage=args.storage, rate=rate))
+                out.flush()
+                print(f"rate {rate:g}/s: {row['throughput']} updates/s, p99 {row['p99_ms']} ms, "
+                      f"cpu {row['cpu_percent']}%", file=sys.stderr)
+        finally:
+            await application.shutdown()
+
+    asyncio.run(run())
+    print(f"API calls: {dict(request.calls)}; admission: {dict(application.update_processor.stats)}",
+          file=sys.stderr)
+    if out is not sys.stdout:
+        out.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks for the organizer bot")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    admission = subparsers.add_parser('admission', help="latency of well-behaved users during a flood")
+    admission.add_argument('--duration', type=float, default=5.0)
+    admission.add_argument('--users', type=int, default=50)
+    admission.add_argument('--handler-ms', type=float, default=5.0)
+    admission.add_argument('--cpu-ms', type=float, default=0.5)
+    admission.add_argument('--flood-rate', type=int, default=5000)
+    admission.set_defaults(func=bench_admission)
+
+    parse = subparsers.add_parser('parse', help="input parsers vs the strptime path")
+    parse.add_argument('--number', type=int, default=20000)
+    parse.set_defaults(func=bench_parse)
+
+    inline = subparsers.add_parser('inline', help="inline search latency at keystroke rate")
+    inline.add_argument('--duration', type=float, default=5.0)
+    inline.add_argument('--users', type=int, default=50)
+    inline.add_argument('--items', type=int, default=300)
+    inline.add_argument('--keystroke-ms', type=float, default=120.0)
+    inline.add_argument('--seed', type=int, default=1)
+    inline.set_defaults(func=bench_inline)
+
+    actions = subparsers.add_parser('actions', help="check each item action touches one row by primary key")
+    actions.add_argument('--users', type=int, default=3)
+    actions.add_argument('--items', type=int, default=5)
+    actions.set_defaults(func=check_item_actions)
+
+    analytics = subparsers.add_parser('analytics', help="NumPy expense analytics vs a pure-Python loop")
+    analytics.add_argument('--rows', type=int, default=10_000_000)
+    analytics.add_argument('--days', type=int, default=3650)
+    analytics.add_argument('--categories', type=int, default=20)
+    analytics.add_argument('--window', type=int, default=7)
+    analytics.add_argument('--load-rows', type=int, default=200_000)
+    analytics.add_argument('--seed', type=int, default=1)
+    analytics.set_defaults(func=bench_analytics)
+
+    delivery = subparsers.add_parser('delivery', help="reminders across a SIGKILL and a lease handoff, exactly once")
+    delivery.add_argument('--reminders', type=int, default=600)
+    delivery.add_argument('--spread', type=float, default=10.0, help="seconds the scheduled reminders span")
+    delivery.add_argument('--kill-after', type=int, default=250, help="SIGKILL worker A after this many sends")
+    delivery.add_argument('--handoff-after', type=int, default=50, help="start C after B has sent this many")
+    delivery.add_argument('--send-ms', type=float, default=5.0)
+    delivery.add_argument('--send-rate', type=float, default=200.0)
+    delivery.add_argument('--lease-ttl', type=float, default=3.0)
+    delivery.add_argument('--claim-timeout', type=float, default=2.0)
+    delivery.set_defaults(func=bench_delivery)
+
+    load = subparsers.add_parser('load', help="drive the real handlers at rising arrival rates, CSV capacity curve")
+    load.add_argument('--db', help="database to seed and load-test; a temp file by default")
+    load.add_argument('--reuse', action='store_true', help="run against an already seeded --db")
+    load.add_argument('--storage', choices=('sqlite', 'memory'), default='sqlite')
+    load.add_argument('--users', type=int, default=1000)
+    load.add_argument('--tasks', type=int, default=30)
+    load.add_argument('--expenses', type=int, default=200)
+    load.add_argument('--notes', type=int, default=30)
+    load.add_argument('--reminders', type=int, default=5)
+    load.add_argument('--rates', type=lambda text: [float(rate) for rate in text.split(',')],
+                      default=[10, 25, 50, 100, 200, 400], help="actions per second, one CSV row each")
+    load.add_argument('--duration', type=float, default=10.0, help="seconds per rate")
+    load.add_argument('--mix', type=parse_mix, default=parse_mix("menu=40,list=40,flow=20"))
+    load.add_argument('--api-ms', type=float, default=0.0, help="simulated Bot API round trip")
+    load.add_argument('--csv', help="write the CSV here instead of stdout")
+    load.add_argument('--seed', type=int, default=1)
+    load.set_defaults(func=bench_load)
+
+    worker = subparsers.add_parser('delivery-worker')
+    worker.add_argument('--db', required=True)
+    worker.add_argument('--sink', required=True)
+    worker.add_argument('--name', required=True)
+    worker.add_argument('--send-ms', type=float, default=5.0)
+    worker.add_argument('--send-rate', type=float, default=200.0)
+    worker.add_argument('--lease-ttl', type=float, default=3.0)
+    worker.add_argument('--claim-timeout', type=float, default=2.0)
+    worker.set_defaults(func=delivery_worker)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
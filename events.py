@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+import sys
+from collections import Counter, defaultdict
+from datetime import datetime
+
+# expense_created events logged before multi-currency support carry no currency
+DEFAULT_CURRENCY = "RUB"
+
+
+def log_files(path: str) -> list:
+    rotated = []
+    index = 1
+    while os.path.exists(f"{path}.{index}"):
+        rotated.append(f"{path}.{index}")
+        index += 1
+    files = list(reversed(rotated))
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def replay(path: str, since: float = None, until: float = None):
+    for name in log_files(path):
+        with open(name, encoding='utf-8') as f:
+            for number, line in enumerate(f, start=1):
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    print(f"{name}:{number}: skipping malformed line", file=sys.stderr)
+                    continue
+                if since is not None and event['ts'] < since:
+                    continue
+                if until is not None and event['ts'] >= until:
+                    continue
+                yield event
+
+
+def collect(events) -> dict:
+    stats = {
+        'events': Counter(),
+        'days': Counter(),
+        'users': set(),
+        'categories': defaultdict(float),
+        'fired': Counter(),
+        'errors': Counter(),
+        'first': None,
+        'last': None,
+    }
+    for event in events:
+        kind = event['event']
+        stats['events'][kind] += 1
+        stats['days'][datetime.fromtimestamp(event['ts']).strftime('%Y-%m-%d')] += 1
+        stats['first'] = event['ts'] if stats['first'] is None else stats['first']
+        stats['last'] = event['ts']
+        if event.get('user_id') is not None:
+            stats['users'].add(event['user_id'])
+        if kind == 'expense_created':
+            stats['categories'][event['category'], event.get('currency', DEFAULT_CURRENCY)] += event['amount']
+        elif kind == 'reminder_fired':
+            stats['fired'][event.get('source')] += 1
+        elif kind == 'error':
+            stats['errors'][event['error']] += 1
+    return stats
+
+
+def print_stats(stats: dict, top: int) -> None:
+    if stats['first'] is None:
+        print("No events.")
+        return
+    first = datetime.fromtimestamp(stats['first']).strftime('%d.%m.%Y %H:%M')
+    last = datetime.fromtimestamp(stats['last']).strftime('%d.%m.%Y %H:%M')
+    print(f"Events {first} - {last}: {sum(stats['events'].values())}, users: {len(stats['users'])}")
+
+    print("\nBy event:")
+    for kind, total in stats['events'].most_common():
+        print(f"  {kind:<20}{total:>10}")
+
+    print("\nBy day:")
+    for day, total in sorted(stats['days'].items()):
+        print(f"  {day:<20}{total:>10}")
+
+    if stats['categories']:
+        print("\nExpenses by category:")
+        for currency in sorted({currency for _, currency in stats['categories']}):
+            totals = [(category, amount) for (category, code), amount in stats['categories'].items() if code == currency]
+            for category, amount in sorted(totals, key=lambda item: -item[1])[:top]:
+                print(f"  {category[:20]:<20}{amount:>10.2f} {currency}")
+
+    scheduled = stats['events']['reminder_scheduled']
+    if scheduled or stats['fired']:
+        fired = ", ".join(f"{source}: {total}" for source, total in stats['fired'].items())
+        print(f"\nReminders: {scheduled} scheduled, {sum(stats['fired'].values())} fired ({fired}), "
+              f"{stats['events']['reminder_expired']} expired")
+
+    if stats['errors']:
+        print("\nErrors:")
+        for error, total in stats['errors'].most_common(top):
+            print(f"  {error:<20}{total:>10}")
+
+
+def parse_date(text: str) -> float:
+    return datetime.strptime(text, '%Y-%m-%d').timestamp()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay the organizer bot event log into stats")
+    parser.add_argument('path', nargs='?', default="events.jsonl")
+    parser.add_argument('--since', type=parse_date, help="YYYY-MM-DD, inclusive")
+    parser.add_argument('--until', type=parse_date, help="YYYY-MM-DD, exclusive")
+    parser.add_argument('--event', action='append', help="only replay these event types")
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    events = replay(args.path, args.since, args.until)
+    if args.event:
+        events = (event for event in events if event['event'] in args.event)
+    print_stats(collect(events), args.top)
+
+
+if __name__ == "__main__":
+    main()
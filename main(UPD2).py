@@ -1,18 +1,55 @@
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+)
 from telegram.ext import (
     Application,
+    BaseUpdateProcessor,
     CommandHandler,
     ContextTypes,
     CallbackQueryHandler,
     ConversationHandler,
+    InlineQueryHandler,
     MessageHandler,
     filters,
 )
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+import asyncio
+import cProfile
+from abc import ABC, abstractmethod
+import functools
+import glob
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import os
+import pstats
+import random
+import re
+import shutil
+import signal
 import sqlite3
-from datetime import datetime
+import threading
+import time
+import tracemalloc
+from datetime import datetime, time as dt_time, timedelta
 from pytz import timezone
 import uuid
+from bisect import bisect_left
+from collections import Counter, OrderedDict, deque
+from itertools import chain, count, groupby
+from typing import NamedTuple, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 logging.basicConfig(
@@ -25,20 +62,114 @@ TOKEN = "tok"
 DB_NAME = "organizer.db"
 TIMEZONE = timezone("Europe/Moscow")
 
+SEND_RATE_LIMIT = 25
+MISSED_REMINDER_GRACE = timedelta(hours=12)
+CATCH_UP_BATCH_SIZE = 200
+CATCH_UP_INTERVAL = timedelta(minutes=1)
+CATCH_UP_DELAY = timedelta(seconds=30)
+REMINDER_CLAIM_TIMEOUT = timedelta(minutes=2)
+BUDGET_ALERT_THRESHOLDS = (0.8, 1.0)
+DIGEST_TIME = dt_time(8, 0, tzinfo=TIMEZONE)
+DUE_SWEEP_INTERVAL = timedelta(minutes=1)
+DUE_SWEEP_BATCH_SIZE = 100
+DUE_SWEEP_MAX_RETRIES = 3
+
+ATTACHMENT_DIR = "attachments"
+ATTACHMENT_MAX_BYTES = 20 * 1024 * 1024
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+ATTACHMENT_CACHE_BYTES = 32 * 1024 * 1024
+ATTACHMENT_CACHE_MAX_BLOB = 2 * 1024 * 1024
+ATTACHMENT_GC_GRACE = timedelta(days=1)
+
+SCHEDULER_LEASE = "scheduler"
+LEASE_TTL = timedelta(seconds=15)
+LEASE_RENEW_INTERVAL = timedelta(seconds=2)
+HANDOFF_POLL_INTERVAL = 0.5
+DRAIN_DEADLINE = timedelta(seconds=20)
+
+EVENT_LOG_PATH = "events.jsonl"
+EVENT_BUFFER_SIZE = 10000
+EVENT_FLUSH_INTERVAL = timedelta(seconds=5)
+EVENT_LOG_MAX_BYTES = 10 * 1024 * 1024
+EVENT_LOG_KEEP = 5
+
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = "profiles"
+PROFILE_TOP_ALLOCATIONS = 25
+
+DEFAULT_CURRENCY = "RUB"
+RATES_FILE = "rates.json"
+RATES_CHECK_INTERVAL = 5
+CURRENCY_LABELS = {'RUB': "руб."}
+CURRENCY_ALIASES = {
+    '₽': 'RUB', 'р': 'RUB', 'руб': 'RUB', 'рубль': 'RUB', 'рублей': 'RUB',
+    '$': 'USD', 'долл': 'USD', 'доллар': 'USD', 'долларов': 'USD',
+    '€': 'EUR', 'евро': 'EUR', '£': 'GBP', '¥': 'CNY', 'юань': 'CNY', 'юаней': 'CNY',
+    '₸': 'KZT', 'тг': 'KZT', 'тенге': 'KZT',
+}
+
+ANALYTICS_DEFAULT_DAYS = 90
+ANALYTICS_PERCENTILES = (50, 90, 99)
+ANALYTICS_WINDOW = 7
+ANALYTICS_TOP_CATEGORIES = 5
+
+LIST_PAGE_SIZE = 5
+MESSAGE_LIMIT = 4096
+LIST_CACHE_TTL = 300
+LIST_CACHE_MAX_USERS = 10000
+
+INLINE_RESULTS_LIMIT = 20
+INLINE_CACHE_TTL = 10
+INLINE_INDEX_MAX_USERS = 1000
+INLINE_NOTES_LIMIT = 1000
+SEARCH_TOKEN_RE = re.compile(r"\w+")
+
+ADMIN_IDS = set()
+
+MAX_CONCURRENT_UPDATES = 32
+MAX_PENDING_UPDATES = 512
+USER_RATE_LIMIT = 1.0
+USER_BURST = 5
+MAX_TRACKED_USERS = 10000
+
+ARCHIVE_DB_NAME = "organizer_archive.db"
+MAINTENANCE_INTERVAL = timedelta(hours=6)
+ANALYZE_INTERVAL = timedelta(days=1)
+ANALYZE_ROW_LIMIT = 1000
+MAINTENANCE_BATCH_SIZE = 500
+MAINTENANCE_PAUSE = 0.05
+VACUUM_PAGES_PER_STEP = 1000
+
+BACKUP_DIR = "backups"
+BACKUP_INTERVAL = timedelta(days=1)
+BACKUP_KEEP = 7
+EXPENSE_RETENTION = timedelta(days=365)
+RETENTION_POLICIES = (
+    ('tasks', "completed=1 AND created < ?", timedelta(days=90)),
+    ('expenses', "created < ?", EXPENSE_RETENTION),
+    ('notes', "created < ?", timedelta(days=365)),
+)
+
 
 (
     TASK_STATES, EXPENSE_STATES, NOTE_STATES, REMINDER_STATES,
     SET_TASK, SET_PRIORITY, SET_DUE_DATE,
     SET_EXPENSE_AMOUNT, SET_EXPENSE_CATEGORY,
     SET_NOTE_TEXT, SET_NOTE_TAGS,
-    SET_REMINDER_TEXT, SET_REMINDER_TIME
-) = range(13)
+    SET_REMINDER_TEXT, SET_REMINDER_TIME,
+    EDIT_ITEM
+) = range(14)
 
 
 def init_db():
     conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
 
+    c.execute("PRAGMA journal_mode=WAL")
+    if c.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        c.execute("VACUUM")
+
     c.execute('''CREATE TABLE IF NOT EXISTS tasks
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
                   user_id INTEGER,
@@ -68,11 +199,1525 @@ def init_db():
                   text TEXT,
                   trigger_time DATETIME)''')
 
+    c.execute('''CREATE TABLE IF NOT EXISTS budgets
+                 (user_id INTEGER,
+                  category TEXT,
+                  monthly_limit REAL,
+                  PRIMARY KEY (user_id, category))''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS budget_totals
+                 (user_id INTEGER,
+                  category TEXT,
+                  period TEXT,
+                  currency TEXT,
+                  total REAL,
+                  PRIMARY KEY (user_id, category, period, currency))''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS user_settings
+                 (user_id INTEGER PRIMARY KEY,
+                  base_currency TEXT)''')
+
+    if 'currency' not in {row[1] for row in c.execute("PRAGMA table_info(expenses)")}:
+        c.execute("ALTER TABLE expenses ADD COLUMN currency TEXT")
+    if 'currency' not in {row[1] for row in c.execute("PRAGMA table_info(budget_totals)")}:
+        c.execute("ALTER TABLE budget_totals RENAME TO budget_totals_old")
+        c.execute('''CREATE TABLE budget_totals
+                     (user_id INTEGER,
+                      category TEXT,
+                      period TEXT,
+                      currency TEXT,
+                      total REAL,
+                      PRIMARY KEY (user_id, category, period, currency))''')
+        c.execute("INSERT INTO budget_totals SELECT user_id, category, period, ?, total FROM budget_totals_old",
+                  (DEFAULT_CURRENCY,))
+        c.execute("DROP TABLE budget_totals_old")
+
+    c.execute('''CREATE TABLE IF NOT EXISTS attachments
+                 (file_unique_id TEXT PRIMARY KEY,
+                  file_hash TEXT NOT NULL,
+                  size INTEGER)''')
+
+    for table in ('tasks', 'reminders'):
+        if 'chat_id' not in {row[1] for row in c.execute(f"PRAGMA table_info({table})")}:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN chat_id INTEGER")
+            c.execute(f"UPDATE {table} SET chat_id = user_id")
+    reminder_columns = {row[1] for row in c.execute("PRAGMA table_info(reminders)")}
+    for column, kind in (('claimed_by', 'TEXT'), ('claimed_until', 'DATETIME')):
+        if column not in reminder_columns:
+            c.execute(f"ALTER TABLE reminders ADD COLUMN {column} {kind}")
+    note_columns = {row[1] for row in c.execute("PRAGMA table_info(notes)")}
+    for column in ('file_id', 'file_hash', 'file_kind'):
+        if column not in note_columns:
+            c.execute(f"ALTER TABLE notes ADD COLUMN {column} TEXT")
+    # older rows were saved as str(datetime), with an offset or microseconds; the sweeps page by
+    # (time, id) against format_db_datetime strings and would keep returning such a row
+    for table, column in (('tasks', 'due'), ('tasks', 'created'), ('reminders', 'trigger_time')):
+        rows = c.execute(f"SELECT rowid, {column} FROM {table} WHERE {column} NOT GLOB "
+                         "'[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]'").fetchall()
+        c.executemany(f"UPDATE {table} SET {column}=? WHERE rowid=?",
+                      [(format_db_datetime(parse_db_datetime(value)), rowid) for rowid, value in rows])
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_reminders_trigger_time ON reminders (trigger_time, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_reminders_chat ON reminders (chat_id, trigger_time)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tasks_chat ON tasks (chat_id, completed, due)")
+    c.execute('''CREATE TABLE IF NOT EXISTS leases
+                 (name TEXT PRIMARY KEY,
+                  owner TEXT,
+                  expires DATETIME,
+                  successor TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS sweeper_state
+                 (name TEXT PRIMARY KEY,
+                  watermark DATETIME,
+                  last_id INTEGER)''')
+
+    c.execute("DROP INDEX IF EXISTS idx_tasks_due")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tasks_completed_due ON tasks (completed, due, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_expenses_created ON expenses (created)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_expenses_user_created ON expenses (user_id, created, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_notes_user_created ON notes (user_id, created, id)")
+
     conn.commit()
     conn.close()
 
 
-init_db()
+@functools.lru_cache(maxsize=4096)
+def local_tzinfo(year: int, month: int, day: int, hour: int):
+    return TIMEZONE.localize(datetime(year, month, day, hour)).tzinfo
+
+
+def localize(value: datetime) -> datetime:
+    return value.replace(tzinfo=local_tzinfo(value.year, value.month, value.day, value.hour))
+
+
+def parse_db_datetime(value):
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return localize(value)
+    return value.astimezone(TIMEZONE)
+
+
+def format_db_datetime(value: datetime) -> str:
+    if value.tzinfo is not None:
+        value = value.astimezone(TIMEZONE)
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+LOCAL_EPOCH = datetime(1970, 1, 1)
+
+
+def local_seconds(value: datetime) -> int:
+    """Seconds of TIMEZONE wall-clock time since 1970-01-01, as SQLite's strftime('%s') counts stored values."""
+    if value.tzinfo is not None:
+        value = value.astimezone(TIMEZONE).replace(tzinfo=None)
+    return int((value - LOCAL_EPOCH).total_seconds())
+
+
+DATE_INPUT_RE = re.compile(r"^\s*(\d{1,2})\.(\d{1,2})\.(\d{4})\s+(\d{1,2})[:.](\d{2})\s*$")
+DAY_INPUT_RE = re.compile(r"^\s*(сегодня|завтра|послезавтра)(?:\s+(?:в\s+)?(\d{1,2})(?:[:.](\d{2}))?)?\s*$",
+                          re.IGNORECASE)
+RELATIVE_INPUT_RE = re.compile(
+    r"^\s*(?:через\s+(\d+)?\s*(мин|минут[уы]?|час|часа|часов|день|дня|дней|неделю|недели|недель)"
+    r"|\+\s*(\d+)\s*([mhdw]|мин|м|ч|д|н))\s*$",
+    re.IGNORECASE
+)
+AMOUNT_INPUT_RE = re.compile(r"^\s*(\d{1,3}(?:[ \u00a0]\d{3})+|\d+)(?:[.,](\d{1,2}))?\s*$")
+PRIORITY_INPUT_RE = re.compile(r"^\s*([1-5])\s*$")
+DAY_OFFSETS = {'сегодня': 0, 'завтра': 1, 'послезавтра': 2}
+RELATIVE_UNITS = {
+    'm': 'minutes', 'м': 'minutes', 'h': 'hours', 'ч': 'hours',
+    'd': 'days', 'д': 'days', 'w': 'weeks', 'н': 'weeks',
+}
+DEFAULT_INPUT_HOUR = 9
+
+
+def parse_datetime_input(text: str, now: datetime = None) -> datetime:
+    match = DATE_INPUT_RE.match(text)
+    if match:
+        day, month, year, hour, minute = map(int, match.groups())
+        return localize(datetime(year, month, day, hour, minute))
+
+    now = now or datetime.now(TIMEZONE)
+    match = DAY_INPUT_RE.match(text)
+    if match:
+        day = now.date() + timedelta(days=DAY_OFFSETS[match.group(1).lower()])
+        hour = int(match.group(2)) if match.group(2) else DEFAULT_INPUT_HOUR
+        minute = int(match.group(3)) if match.group(3) else 0
+        return localize(datetime(day.year, day.month, day.day, hour, minute))
+
+    match = RELATIVE_INPUT_RE.match(text)
+    if match:
+        number = int(match.group(1) or match.group(3) or 1)
+        unit = (match.group(2) or match.group(4)).lower()
+        delta = timedelta(**{RELATIVE_UNITS['м' if unit.startswith('мин') else unit[0]]: number})
+        return localize(now.replace(tzinfo=None) + delta)
+
+    raise ValueError(f"Unrecognized date: {text!r}")
+
+
+def parse_amount(text: str) -> float:
+    match = AMOUNT_INPUT_RE.match(text)
+    if not match:
+        raise ValueError(f"Unrecognized amount: {text!r}")
+    amount = float(match.group(1).replace(" ", "").replace("\u00a0", "") + "." + (match.group(2) or "0"))
+    if amount <= 0:
+        raise ValueError(f"Amount must be positive: {text!r}")
+    return amount
+
+
+MONEY_INPUT_RE = re.compile(r"^\s*([^\d\s.,]+)?\s*([\d \u00a0.,]+?)\s*([^\d\s.,]+)?\.?\s*$")
+
+
+def parse_money(text: str) -> tuple:
+    """Parse "1 250,50", "12.5 USD", "$12" or "100 руб." into (amount, currency code or None)."""
+    match = MONEY_INPUT_RE.match(text)
+    if not match or (match.group(1) and match.group(3)):
+        raise ValueError(f"Unrecognized amount: {text!r}")
+    amount = parse_amount(match.group(2))
+    token = match.group(1) or match.group(3)
+    if token is None:
+        return amount, None
+    currency = CURRENCY_ALIASES.get(token.lower(), token.upper())
+    if not re.fullmatch(r"[A-Z]{3}", currency):
+        raise ValueError(f"Unrecognized currency: {token!r}")
+    return amount, currency
+
+
+def currency_label(currency: Optional[str]) -> str:
+    currency = currency or DEFAULT_CURRENCY
+    return CURRENCY_LABELS.get(currency, currency)
+
+
+def parse_priority(text: str) -> int:
+    match = PRIORITY_INPUT_RE.match(text)
+    if not match:
+        raise ValueError(f"Unrecognized priority: {text!r}")
+    return int(match.group(1))
+
+
+def budget_period(value: datetime) -> str:
+    return value.astimezone(TIMEZONE).strftime("%Y-%m")
+
+
+def budget_category(category: str) -> str:
+    return category.strip().lower()
+
+
+def crossed_thresholds(category: str, limit: float, previous: float, total: float) -> list:
+    return [BudgetAlert(category, limit, total, threshold)
+            for threshold in BUDGET_ALERT_THRESHOLDS if previous < limit * threshold <= total]
+
+
+class RateLimitedSender:
+    def __init__(self, bot, rate: float = SEND_RATE_LIMIT):
+        self.bot = bot
+        self.interval = 1 / rate
+        self.sent = 0
+        self.failed = 0
+        self._lock = asyncio.Lock()
+        self._next_slot = 0.0
+
+    async def _wait_slot(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            if self._next_slot > now:
+                await asyncio.sleep(self._next_slot - now)
+                now = self._next_slot
+            self._next_slot = now + self.interval
+
+    async def send(self, chat_id: int, text: str, **kwargs) -> bool:
+        await self._wait_slot()
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if isinstance(retry_after, timedelta):
+                retry_after = retry_after.total_seconds()
+            async with self._lock:
+                self._next_slot = max(self._next_slot, time.monotonic() + retry_after)
+            return await self.send(chat_id, text, **kwargs)
+        except TelegramError as e:
+            # a timeout or dropped connection may go through later; a blocked bot, a migrated chat
+            # or a bad request will not, so those count as failed sends instead of raising
+            if isinstance(e, NetworkError) and not isinstance(e, BadRequest):
+                raise
+            logger.warning("Could not deliver message to %s: %s", chat_id, e)
+            self.failed += 1
+            return False
+        self.sent += 1
+        return True
+
+    def enqueue(self, application: Application, chat_id: int, text: str, **kwargs) -> None:
+        application.create_task(self.send(chat_id, text, **kwargs))
+
+
+class ExchangeRates:
+    """Exchange rates from RATES_FILE, cached in memory.
+
+    The file is a JSON object with the price of one unit of each currency in
+    DEFAULT_CURRENCY, e.g. {"USD": 92.5, "EUR": 100.2}. It is stat()ed at most
+    once per check_interval and reloaded when its mtime or size changes; if it
+    cannot be parsed the previous rates stay in effect.
+    """
+
+    def __init__(self, path: str = RATES_FILE, check_interval: float = RATES_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self.rates = {DEFAULT_CURRENCY: 1.0}
+        self.version = None
+        self.checked = None
+
+    def current(self) -> dict:
+        now = time.monotonic()
+        if self.checked is None or now - self.checked >= self.check_interval:
+            self.checked = now
+            self.reload()
+        return self.rates
+
+    def reload(self) -> None:
+        try:
+            stat = os.stat(self.path)
+            version = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            version = None
+        if version == self.version:
+            return
+
+        rates = {DEFAULT_CURRENCY: 1.0}
+        if version is not None:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    rates.update({code.upper(): float(rate) for code, rate in json.load(f).items()})
+            except (OSError, ValueError, TypeError, AttributeError) as e:
+                logger.warning("Could not load exchange rates from %s: %s", self.path, e)
+                return
+        self.version = version
+        self.rates = rates
+        logger.info("Loaded %d exchange rates from %s", len(rates) - 1, self.path)
+
+    def factor(self, currency: Optional[str], base: str) -> Optional[float]:
+        rates = self.current()
+        source, target = rates.get(currency or DEFAULT_CURRENCY), rates.get(base)
+        if not source or not target:
+            return None
+        return source / target
+
+    def convert(self, amount: float, currency: Optional[str], base: str) -> Optional[float]:
+        factor = self.factor(currency, base)
+        return None if factor is None else amount * factor
+
+    def total(self, amounts, base: str) -> float:
+        """Sum (amount, currency) pairs in base; amounts without a known rate are left out."""
+        total = 0.0
+        for amount, currency in amounts:
+            converted = self.convert(amount, currency, base)
+            if converted is None:
+                logger.warning("No exchange rate for %s, %.2f left out of a %s total", currency, amount, base)
+                continue
+            total += converted
+        return total
+
+
+exchange_rates = ExchangeRates()
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+
+    def take(self, now: float, rate: float, burst: float) -> bool:
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class AdmissionUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES,
+                 max_pending: int = MAX_PENDING_UPDATES,
+                 rate: float = USER_RATE_LIMIT, burst: float = USER_BURST):
+        super().__init__(max_concurrent_updates)
+        self.max_pending = max_pending
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.in_flight = set()
+        self.tasks = set()
+        self.pending = 0
+        self.stats = {'admitted': 0, 'shed_user': 0, 'shed_global': 0, 'coalesced': 0}
+
+    def _admit_user(self, user_id: int) -> bool:
+        now = time.monotonic()
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            if len(self.buckets) >= MAX_TRACKED_USERS:
+                idle = self.burst / self.rate
+                self.buckets = {uid: b for uid, b in self.buckets.items() if now - b.updated < idle}
+            bucket = self.buckets[user_id] = TokenBucket(self.burst, now)
+        return bucket.take(now, self.rate, self.burst)
+
+    async def process_update(self, update: object, coroutine) -> None:
+        key = None
+        if isinstance(update, Update):
+            query = update.callback_query
+            if query is not None:
+                key = (query.from_user.id, query.data, query.message.message_id if query.message else None)
+                if key in self.in_flight:
+                    self.stats['coalesced'] += 1
+                    coroutine.close()
+                    return
+            # inline queries arrive per keystroke; stale ones are cancelled by the search index instead
+            if update.effective_user and update.inline_query is None \
+                    and not self._admit_user(update.effective_user.id):
+                self.stats['shed_user'] += 1
+                coroutine.close()
+                return
+        if self.pending >= self.max_pending:
+            self.stats['shed_global'] += 1
+            coroutine.close()
+            return
+
+        self.stats['admitted'] += 1
+        self.pending += 1
+        if key is not None:
+            self.in_flight.add(key)
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            await super().process_update(update, coroutine)
+        finally:
+            self.pending -= 1
+            self.tasks.discard(task)
+            if key is not None:
+                self.in_flight.discard(key)
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+class EventLog:
+    """Append-only JSON-lines audit log.
+
+    Handlers only append to an in-memory ring buffer; a repeating job drains it
+    and writes the batch from a worker thread, rotating the file once it grows
+    past max_bytes. If the buffer overflows, the oldest events are dropped and
+    counted.
+    """
+
+    def __init__(self, path: str = EVENT_LOG_PATH, buffer_size: int = EVENT_BUFFER_SIZE,
+                 max_bytes: int = EVENT_LOG_MAX_BYTES, keep: int = EVENT_LOG_KEEP):
+        self.path = path
+        self.buffer = deque(maxlen=buffer_size)
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.written = 0
+        self.dropped = 0
+        self.flushing = False
+
+    def record(self, event: str, **fields) -> None:
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append({'ts': round(time.time(), 3), 'event': event, **fields})
+
+    def drain(self) -> list:
+        batch = list(self.buffer)
+        self.buffer.clear()
+        return batch
+
+    def write(self, batch: list) -> None:
+        lines = "".join(json.dumps(event, ensure_ascii=False, separators=(',', ':'), default=str) + "\n"
+                        for event in batch)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+        if os.path.getsize(self.path) >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self) -> None:
+        for index in range(self.keep - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    async def flush(self) -> None:
+        if self.flushing or not self.buffer:
+            return
+        self.flushing = True
+        batch = self.drain()
+        try:
+            await asyncio.to_thread(self.write, batch)
+            self.written += len(batch)
+        except OSError as e:
+            logger.warning("Could not write %d events to %s: %s", len(batch), self.path, e)
+            self.dropped += len(batch)
+        finally:
+            self.flushing = False
+
+
+event_log = EventLog()
+
+
+class Lifecycle:
+    """Scheduler lease, graceful drain and hot handoff between bot processes.
+
+    Only the process holding the scheduler lease runs jobs. A new process asks
+    the holder to hand off and waits; the holder stops polling and pauses its
+    jobs, lets reminder deliveries finish, returns its reminder claims and the
+    lease, so the successor takes over scheduling while the old process is
+    still draining in-flight updates. Everything left at DRAIN_DEADLINE is
+    cancelled.
+    """
+
+    def __init__(self):
+        self.instance_id = uuid.uuid4().hex
+        self.deliveries = set()
+        self.draining = False
+
+    async def acquire(self) -> None:
+        requested = False
+        while True:
+            now = datetime.now(TIMEZONE)
+            acquired, _ = storage.acquire_lease(SCHEDULER_LEASE, self.instance_id, now + LEASE_TTL, now)
+            if acquired:
+                logger.info("Instance %s took over scheduling", self.instance_id)
+                return
+            if not requested:
+                storage.request_handoff(SCHEDULER_LEASE, self.instance_id)
+                logger.info("Waiting for the running instance to hand over scheduling")
+                requested = True
+            await asyncio.sleep(HANDOFF_POLL_INTERVAL)
+
+    async def heartbeat(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        now = datetime.now(TIMEZONE)
+        acquired, successor = storage.acquire_lease(SCHEDULER_LEASE, self.instance_id, now + LEASE_TTL, now)
+        if not acquired:
+            logger.error("Scheduler lease lost, shutting down")
+        elif successor:
+            logger.info("Instance %s requested a handoff", successor)
+        else:
+            return
+        context.application.create_task(self.shutdown(context.application))
+
+    def stop_signal(self, application: Application) -> None:
+        if self.draining:
+            logger.warning("Second stop signal, stopping without draining")
+            application.stop_running()
+            return
+        application.create_task(self.shutdown(application))
+
+    async def shutdown(self, application: Application) -> None:
+        if self.draining:
+            return
+        self.draining = True
+        started = time.monotonic()
+        deadline = started + DRAIN_DEADLINE.total_seconds()
+        application.job_queue.scheduler.pause()
+        if application.updater and application.updater.running:
+            await application.updater.stop()
+
+        await self.drain(self.deliveries, deadline, "reminder deliveries")
+        released = storage.release_reminders(self.instance_id)
+        storage.release_lease(SCHEDULER_LEASE, self.instance_id)
+        logger.info("Scheduling released after %.2fs, %d reminder claims returned",
+                    time.monotonic() - started, released)
+
+        await self.drain(application.update_processor.tasks, deadline, "updates")
+        logger.info("Drained in %.2fs", time.monotonic() - started)
+        application.stop_running()
+
+    @staticmethod
+    async def drain(tasks: set, deadline: float, what: str) -> None:
+        if tasks:
+            await asyncio.wait(set(tasks), timeout=max(deadline - time.monotonic(), 0))
+        if tasks:
+            logger.warning("Drain deadline reached, cancelling %d in-flight %s", len(tasks), what)
+            for task in list(tasks):
+                task.cancel()
+
+
+lifecycle = Lifecycle()
+
+
+class Task(NamedTuple):
+    id: int
+    user_id: int
+    task: str
+    priority: int
+    created: datetime
+    due: Optional[datetime]
+    completed: bool
+    chat_id: int
+
+
+class Expense(NamedTuple):
+    id: int
+    user_id: int
+    amount: float
+    category: str
+    created: datetime
+    currency: Optional[str] = None
+
+
+class ExpenseColumns(NamedTuple):
+    """Expenses as parallel NumPy arrays ordered by creation time.
+
+    created holds local_seconds(), so created // 86400 is the local day number;
+    category holds codes into categories, which are budget_category() keys, and
+    currency codes into currencies. Amounts are in their own currency until
+    convert_columns() is applied.
+    """
+    amount: "np.ndarray"
+    created: "np.ndarray"
+    category: "np.ndarray"
+    categories: list
+    currency: "np.ndarray"
+    currencies: list
+
+
+EXPENSE_COLUMNS_DTYPE = [('amount', 'f8'), ('created', 'i8'), ('category', 'O'), ('currency', 'O')]
+
+
+def expense_columns(data) -> ExpenseColumns:
+    """Build ExpenseColumns from rows of EXPENSE_COLUMNS_DTYPE, coding the strings with np.unique."""
+    names, name_codes = np.unique(data['category'], return_inverse=True)
+    currencies, currency_codes = np.unique(data['currency'], return_inverse=True)
+    keys = [budget_category(name) for name in names]
+    categories = sorted(set(keys))
+    codes = {key: code for code, key in enumerate(categories)}
+    lookup = np.array([codes[key] for key in keys], dtype=np.int32)
+    return ExpenseColumns(np.ascontiguousarray(data['amount']), np.ascontiguousarray(data['created']),
+                          lookup[name_codes], categories, currency_codes.astype(np.int32), list(currencies))
+
+
+def convert_columns(columns: ExpenseColumns, base: str) -> ExpenseColumns:
+    """Return columns with every amount in base; rows in a currency without a rate are dropped."""
+    factors = np.array([exchange_rates.factor(currency, base) or np.nan for currency in columns.currencies])
+    amount = columns.amount * factors[columns.currency] if len(factors) else columns.amount
+    known = ~np.isnan(amount)
+    if not known.all():
+        logger.warning("No exchange rate for %d expenses, left out of %s analytics", (~known).sum(), base)
+        return ExpenseColumns(amount[known], columns.created[known], columns.category[known], columns.categories,
+                              np.zeros(known.sum(), dtype=np.int32), [base])
+    return columns._replace(amount=amount, currency=np.zeros(len(amount), dtype=np.int32), currencies=[base])
+
+
+class Attachment(NamedTuple):
+    file_id: str
+    file_hash: str
+    kind: str
+
+
+class Note(NamedTuple):
+    id: int
+    user_id: int
+    text: str
+    tags: Optional[str]
+    created: datetime
+    attachment: Optional[Attachment] = None
+
+
+class Reminder(NamedTuple):
+    id: str
+    user_id: int
+    text: str
+    trigger_time: datetime
+    chat_id: int
+
+
+class Budget(NamedTuple):
+    category: str
+    monthly_limit: float
+    spent: float
+
+
+class BudgetAlert(NamedTuple):
+    category: str
+    monthly_limit: float
+    spent: float
+    threshold: float
+
+
+class Storage(ABC):
+    """Persistence for the bot; SQLiteStorage in production, MemoryStorage to take disk I/O out of benchmarks."""
+
+    @abstractmethod
+    def get_tasks(self, chat_id: int) -> list:
+        ...
+
+    @abstractmethod
+    def add_task(self, user_id: int, task: str, priority: int, due: datetime = None, chat_id: int = None) -> int:
+        ...
+
+    @abstractmethod
+    def complete_task(self, chat_id: int, task_id: int) -> bool:
+        ...
+
+    @abstractmethod
+    def update_task(self, chat_id: int, task_id: int, task: str) -> bool:
+        ...
+
+    @abstractmethod
+    def delete_task(self, chat_id: int, task_id: int) -> bool:
+        ...
+
+    @abstractmethod
+    def get_expenses(self, user_id: int, limit: int = 10, offset: int = 0) -> list:
+        ...
+
+    @abstractmethod
+    def add_expense(self, user_id: int, amount: float, category: str, currency: str = None) -> tuple:
+        ...
+
+    @abstractmethod
+    def get_base_currency(self, user_id: int) -> str:
+        ...
+
+    @abstractmethod
+    def set_base_currency(self, user_id: int, currency: str) -> None:
+        ...
+
+    @abstractmethod
+    def get_expense_columns(self, user_id: int = None, start: datetime = None, end: datetime = None) -> ExpenseColumns:
+        ...
+
+    @abstractmethod
+    def set_budget(self, user_id: int, category: str, monthly_limit: float) -> None:
+        ...
+
+    @abstractmethod
+    def get_budgets(self, user_id: int) -> list:
+        ...
+
+    @abstractmethod
+    def iter_digest_rows(self, day_start: datetime, now: datetime):
+        ...
+
+    @abstractmethod
+    def get_due_tasks(self, after: tuple, until: datetime, limit: int) -> list:
+        ...
+
+    @abstractmethod
+    def get_watermark(self, name: str) -> tuple:
+        ...
+
+    @abstractmethod
+    def set_watermark(self, name: str, watermark: datetime, last_id: int) -> None:
+        ...
+
+    @abstractmethod
+    def update_expense(self, user_id: int, expense_id: int, amount: float) -> bool:
+        ...
+
+    @abstractmethod
+    def delete_expense(self, user_id: int, expense_id: int) -> bool:
+        ...
+
+    @abstractmethod
+    def get_notes(self, user_id: int, limit: int = 10, offset: int = 0) -> list:
+        ...
+
+    @abstractmethod
+    def get_note(self, user_id: int, note_id: int) -> Optional[Note]:
+        ...
+
+    @abstractmethod
+    def add_note(self, user_id: int, text: str, tags: str = None, attachment: Attachment = None) -> int:
+        ...
+
+    @abstractmethod
+    def update_note(self, user_id: int, note_id: int, text: str) -> bool:
+        ...
+
+    @abstractmethod
+    def delete_note(self, user_id: int, note_id: int) -> bool:
+        ...
+
+    @abstractmethod
+    def get_attachment_hash(self, file_unique_id: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def add_attachment(self, file_unique_id: str, file_hash: str, size: int) -> None:
+        ...
+
+    @abstractmethod
+    def get_attachment_hashes(self) -> set:
+        ...
+
+    @abstractmethod
+    def get_reminders(self, chat_id: int) -> list:
+        ...
+
+    @abstractmethod
+    def get_upcoming_reminders(self, after: datetime) -> list:
+        ...
+
+    @abstractmethod
+    def get_overdue_reminders(self, cutoff: datetime, after: tuple, limit: int) -> list:
+        ...
+
+    @abstractmethod
+    def add_reminder(self, user_id: int, text: str, trigger_time: datetime, chat_id: int = None) -> str:
+        ...
+
+    @abstractmethod
+    def delete_reminders(self, reminder_ids: list) -> None:
+        ...
+
+    @abstractmethod
+    def claim_reminder(self, reminder_id: str, owner: str, until: datetime, now: datetime) -> bool:
+        ...
+
+    @abstractmethod
+    def complete_reminder(self, reminder_id: str, owner: str) -> bool:
+        ...
+
+    @abstractmethod
+    def release_reminders(self, owner: str) -> int:
+        ...
+
+    @abstractmethod
+    def acquire_lease(self, name: str, owner: str, expires: datetime, now: datetime) -> tuple:
+        ...
+
+    @abstractmethod
+    def request_handoff(self, name: str, successor: str) -> None:
+        ...
+
+    @abstractmethod
+    def release_lease(self, name: str, owner: str) -> None:
+        ...
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, db_name: str = DB_NAME):
+        self.db_name = db_name
+
+    def _fetch(self, query: str, params: tuple = ()):
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        c.execute(query, params)
+        rows = c.fetchall()
+        conn.close()
+        return rows
+
+    def _execute(self, query: str, params: tuple = ()):
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        c.execute(query, params)
+        conn.commit()
+        conn.close()
+        return c.lastrowid
+
+    def _execute_one(self, query: str, params: tuple = ()) -> bool:
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        c.execute(query, params)
+        conn.commit()
+        conn.close()
+        return c.rowcount == 1
+
+    def _change_expense(self, user_id: int, expense_id: int, amount: Optional[float]) -> bool:
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        c.execute("SELECT amount, category, created, currency FROM expenses WHERE id=? AND user_id=?",
+                  (expense_id, user_id))
+        row = c.fetchone()
+        if row is None:
+            conn.close()
+            return False
+        if amount is None:
+            c.execute("DELETE FROM expenses WHERE id=? AND user_id=?", (expense_id, user_id))
+        else:
+            c.execute("UPDATE expenses SET amount=? WHERE id=? AND user_id=?", (amount, expense_id, user_id))
+        if c.rowcount != 1:
+            conn.rollback()
+            conn.close()
+            return False
+        c.execute("UPDATE budget_totals SET total = total + ? "
+                  "WHERE user_id=? AND category=? AND period=? AND currency=?",
+                  ((amount or 0) - row[0], user_id, budget_category(row[1]), budget_period(parse_db_datetime(row[2])),
+                   row[3] or DEFAULT_CURRENCY))
+        conn.commit()
+        conn.close()
+        return True
+
+    @staticmethod
+    def _task(row) -> Task:
+        return Task(row[0], row[1], row[2], row[3], parse_db_datetime(row[4]), parse_db_datetime(row[5]),
+                    bool(row[6]), row[7])
+
+    @staticmethod
+    def _reminder(row) -> Reminder:
+        return Reminder(row[0], row[1], row[2], parse_db_datetime(row[3]), row[4])
+
+    def get_tasks(self, chat_id: int) -> list:
+        rows = self._fetch("SELECT * FROM tasks WHERE chat_id=? AND completed=0 ORDER BY due", (chat_id,))
+        return [self._task(row) for row in rows]
+
+    def add_task(self, user_id: int, task: str, priority: int, due: datetime = None, chat_id: int = None) -> int:
+        return self._execute(
+            "INSERT INTO tasks (user_id, task, priority, created, due, completed, chat_id) "
+            "VALUES (?, ?, ?, ?, ?, 0, ?)",
+            (user_id, task, priority, format_db_datetime(datetime.now(TIMEZONE)),
+             format_db_datetime(due) if due else None, chat_id or user_id)
+        )
+
+    def complete_task(self, chat_id: int, task_id: int) -> bool:
+        return self._execute_one("UPDATE tasks SET completed=1 WHERE id=? AND chat_id=?", (task_id, chat_id))
+
+    def update_task(self, chat_id: int, task_id: int, task: str) -> bool:
+        return self._execute_one("UPDATE tasks SET task=? WHERE id=? AND chat_id=?", (task, task_id, chat_id))
+
+    def delete_task(self, chat_id: int, task_id: int) -> bool:
+        return self._execute_one("DELETE FROM tasks WHERE id=? AND chat_id=?", (task_id, chat_id))
+
+    def get_expenses(self, user_id: int, limit: int = 10, offset: int = 0) -> list:
+        rows = self._fetch("SELECT * FROM expenses WHERE user_id=? ORDER BY created DESC, id DESC LIMIT ? OFFSET ?",
+                           (user_id, limit, offset))
+        return [Expense(row[0], row[1], row[2], row[3], parse_db_datetime(row[4]), row[5]) for row in rows]
+
+    def get_expense_columns(self, user_id: int = None, start: datetime = None, end: datetime = None) -> ExpenseColumns:
+        conditions, params = ["category IS NOT NULL"], []
+        if user_id is not None:
+            conditions.append("user_id=?")
+            params.append(user_id)
+        if start is not None:
+            conditions.append("created >= ?")
+            params.append(format_db_datetime(start))
+        if end is not None:
+            conditions.append("created < ?")
+            params.append(format_db_datetime(end))
+        where = " AND ".join(conditions)
+
+        conn = sqlite3.connect(self.db_name)
+        source = "main.expenses"
+        # retention moves old expenses to the archive db, so a window reaching back that far reads both
+        if start is None or parse_db_datetime(start) < datetime.now(TIMEZONE) - EXPENSE_RETENTION:
+            attach_archive(conn.cursor())
+            conn.commit()
+            source = ("(SELECT user_id, amount, category, created, currency FROM main.expenses UNION ALL "
+                      "SELECT user_id, amount, category, created, currency FROM archive.expenses)")
+        rows = conn.execute(
+            f"SELECT amount, CAST(strftime('%s', created) AS INTEGER), category, COALESCE(currency, ?) "
+            f"FROM {source} WHERE {where} ORDER BY created",
+            [DEFAULT_CURRENCY] + params
+        )
+        data = np.fromiter(rows, dtype=EXPENSE_COLUMNS_DTYPE)
+        conn.close()
+        return expense_columns(data)
+
+    def add_expense(self, user_id: int, amount: float, category: str, currency: str = None) -> tuple:
+        now = datetime.now(TIMEZONE)
+        key = budget_category(category)
+        period = budget_period(now)
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        c.execute("INSERT INTO expenses (user_id, amount, category, created, currency) VALUES (?, ?, ?, ?, ?)",
+                  (user_id, amount, category, format_db_datetime(now), currency))
+        expense_id = c.lastrowid
+        c.execute("INSERT INTO budget_totals (user_id, category, period, currency, total) VALUES (?, ?, ?, ?, ?) "
+                  "ON CONFLICT (user_id, category, period, currency) DO UPDATE SET total = total + excluded.total",
+                  (user_id, key, period, currency or DEFAULT_CURRENCY, amount))
+        c.execute("SELECT b.monthly_limit, COALESCE(s.base_currency, ?) FROM budgets b "
+                  "LEFT JOIN user_settings s ON s.user_id = b.user_id WHERE b.user_id=? AND b.category=?",
+                  (DEFAULT_CURRENCY, user_id, key))
+        budget = c.fetchone()
+        if budget is not None:
+            c.execute("SELECT total, currency FROM budget_totals WHERE user_id=? AND category=? AND period=?",
+                      (user_id, key, period))
+            totals = c.fetchall()
+        conn.commit()
+        conn.close()
+
+        if budget is None:
+            return expense_id, []
+        monthly_limit, base = budget
+        total = exchange_rates.total(totals, base)
+        previous = total - (exchange_rates.convert(amount, currency, base) or 0.0)
+        return expense_id, crossed_thresholds(category, monthly_limit, previous, total)
+
+    def get_base_currency(self, user_id: int) -> str:
+        rows = self._fetch("SELECT base_currency FROM user_settings WHERE user_id=?", (user_id,))
+        return rows[0][0] if rows else DEFAULT_CURRENCY
+
+    def set_base_currency(self, user_id: int, currency: str) -> None:
+        self._execute("INSERT INTO user_settings (user_id, base_currency) VALUES (?, ?) "
+                      "ON CONFLICT (user_id) DO UPDATE SET base_currency = excluded.base_currency",
+                      (user_id, currency))
+
+    def set_budget(self, user_id: int, category: str, monthly_limit: float) -> None:
+        now = datetime.now(TIMEZONE)
+        key = budget_category(category)
+        period = budget_period(now)
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        if monthly_limit <= 0:
+            c.execute("DELETE FROM budgets WHERE user_id=? AND category=?", (user_id, key))
+        else:
+            c.execute("INSERT OR REPLACE INTO budgets (user_id, category, monthly_limit) VALUES (?, ?, ?)",
+                      (user_id, key, monthly_limit))
+            c.execute("SELECT 1 FROM budget_totals WHERE user_id=? AND category=? AND period=?",
+                      (user_id, key, period))
+            if c.fetchone() is None:
+                c.execute("SELECT category, amount, currency FROM expenses WHERE user_id=? AND created >= ?",
+                          (user_id, period + "-01"))
+                spent = {DEFAULT_CURRENCY: 0.0}
+                for name, amount, currency in c.fetchall():
+                    if budget_category(name) == key:
+                        spent[currency or DEFAULT_CURRENCY] = spent.get(currency or DEFAULT_CURRENCY, 0.0) + amount
+                c.executemany("INSERT INTO budget_totals (user_id, category, period, currency, total) "
+                              "VALUES (?, ?, ?, ?, ?)",
+                              [(user_id, key, period, currency, total) for currency, total in spent.items()])
+        conn.commit()
+        conn.close()
+
+    def get_budgets(self, user_id: int) -> list:
+        rows = self._fetch(
+            "SELECT b.category, b.monthly_limit, t.total, t.currency FROM budgets b "
+            "LEFT JOIN budget_totals t ON t.user_id = b.user_id AND t.category = b.category AND t.period = ? "
+            "WHERE b.user_id=? ORDER BY b.category",
+            (budget_period(datetime.now(TIMEZONE)), user_id)
+        )
+        base = self.get_base_currency(user_id)
+        return [Budget(category, group[0][1], exchange_rates.total(((r[2], r[3]) for r in group if r[2]), base))
+                for category, group in ((category, list(group)) for category, group in groupby(rows, lambda r: r[0]))]
+
+    def iter_digest_rows(self, day_start: datetime, now: datetime):
+        day_end = day_start + timedelta(days=1)
+        conn = sqlite3.connect(self.db_name)
+        tasks = conn.execute(
+            "SELECT chat_id, 0, task, due FROM tasks WHERE completed=0 AND due >= ? AND due < ? "
+            "ORDER BY chat_id, due",
+            (format_db_datetime(day_start), format_db_datetime(day_end))
+        )
+        reminders = conn.execute(
+            "SELECT chat_id, 1, text, trigger_time FROM reminders WHERE trigger_time >= ? AND trigger_time < ? "
+            "ORDER BY chat_id, trigger_time",
+            (format_db_datetime(now), format_db_datetime(now + timedelta(days=1)))
+        )
+        expenses = conn.execute(
+            "SELECT e.user_id, 2, e.category, SUM(e.amount), COUNT(*), COALESCE(e.currency, ?), "
+            "COALESCE(s.base_currency, ?) FROM expenses e LEFT JOIN user_settings s ON s.user_id = e.user_id "
+            "WHERE e.created >= ? AND e.created < ? GROUP BY e.user_id, e.category, 6 ORDER BY e.user_id",
+            (DEFAULT_CURRENCY, DEFAULT_CURRENCY,
+             format_db_datetime(day_start - timedelta(days=1)), format_db_datetime(day_start))
+        )
+        try:
+            yield from heapq.merge(tasks, reminders, expenses, key=lambda row: (row[0], row[1]))
+        finally:
+            conn.close()
+
+    def get_due_tasks(self, after: tuple, until: datetime, limit: int) -> list:
+        rows = self._fetch(
+            "SELECT * FROM tasks WHERE completed=0 AND (due, id) > (?, ?) AND due <= ? "
+            "ORDER BY due, id LIMIT ?",
+            (format_db_datetime(after[0]), after[1], format_db_datetime(until), limit)
+        )
+        return [self._task(row) for row in rows]
+
+    def get_watermark(self, name: str) -> tuple:
+        rows = self._fetch("SELECT watermark, last_id FROM sweeper_state WHERE name=?", (name,))
+        if not rows:
+            return None, 0
+        return parse_db_datetime(rows[0][0]), rows[0][1]
+
+    def set_watermark(self, name: str, watermark: datetime, last_id: int) -> None:
+        self._execute("INSERT OR REPLACE INTO sweeper_state (name, watermark, last_id) VALUES (?, ?, ?)",
+                      (name, format_db_datetime(watermark), last_id))
+
+    def update_expense(self, user_id: int, expense_id: int, amount: float) -> bool:
+        return self._change_expense(user_id, expense_id, amount)
+
+    def delete_expense(self, user_id: int, expense_id: int) -> bool:
+        return self._change_expense(user_id, expense_id, None)
+
+    def get_notes(self, user_id: int, limit: int = 10, offset: int = 0) -> list:
+        rows = self._fetch("SELECT * FROM notes WHERE user_id=? ORDER BY created DESC, id DESC LIMIT ? OFFSET ?",
+                           (user_id, limit, offset))
+        return [self._note(row) for row in rows]
+
+    @staticmethod
+    def _note(row) -> Note:
+        attachment = Attachment(row[5], row[6], row[7]) if row[5] else None
+        return Note(row[0], row[1], row[2], row[3], parse_db_datetime(row[4]), attachment)
+
+    def get_note(self, user_id: int, note_id: int) -> Optional[Note]:
+        rows = self._fetch("SELECT * FROM notes WHERE id=? AND user_id=?", (note_id, user_id))
+        return self._note(rows[0]) if rows else None
+
+    def add_note(self, user_id: int, text: str, tags: str = None, attachment: Attachment = None) -> int:
+        file_id, file_hash, file_kind = attachment or (None, None, None)
+        return self._execute(
+            "INSERT INTO notes (user_id, text, tags, created, file_id, file_hash, file_kind) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (user_id, text, tags, format_db_datetime(datetime.now(TIMEZONE)), file_id, file_hash, file_kind)
+        )
+
+    def update_note(self, user_id: int, note_id: int, text: str) -> bool:
+        return self._execute_one("UPDATE notes SET text=? WHERE id=? AND user_id=?", (text, note_id, user_id))
+
+    def delete_note(self, user_id: int, note_id: int) -> bool:
+        return self._execute_one("DELETE FROM notes WHERE id=? AND user_id=?", (note_id, user_id))
+
+    def get_attachment_hash(self, file_unique_id: str) -> Optional[str]:
+        rows = self._fetch("SELECT file_hash FROM attachments WHERE file_unique_id=?", (file_unique_id,))
+        return rows[0][0] if rows else None
+
+    def add_attachment(self, file_unique_id: str, file_hash: str, size: int) -> None:
+        self._execute("INSERT OR REPLACE INTO attachments (file_unique_id, file_hash, size) VALUES (?, ?, ?)",
+                      (file_unique_id, file_hash, size))
+
+    def get_attachment_hashes(self) -> set:
+        # retention moves old notes to the archive db, and their blobs must outlive the move
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        attach_archive(c)
+        conn.commit()
+        c.execute("SELECT file_hash FROM main.notes WHERE file_hash IS NOT NULL "
+                  "UNION SELECT file_hash FROM archive.notes WHERE file_hash IS NOT NULL")
+        rows = c.fetchall()
+        conn.close()
+        return {row[0] for row in rows}
+
+    def get_reminders(self, chat_id: int) -> list:
+        rows = self._fetch("SELECT * FROM reminders WHERE chat_id=? AND trigger_time > ? ORDER BY trigger_time",
+                           (chat_id, format_db_datetime(datetime.now(TIMEZONE))))
+        return [self._reminder(row) for row in rows]
+
+    def get_upcoming_reminders(self, after: datetime) -> list:
+        rows = self._fetch("SELECT * FROM reminders WHERE trigger_time > ?", (format_db_datetime(after),))
+        return [self._reminder(row) for row in rows]
+
+    def get_overdue_reminders(self, cutoff: datetime, after: tuple, limit: int) -> list:
+        rows = self._fetch(
+            "SELECT * FROM reminders WHERE trigger_time <= ? AND (trigger_time, id) > (?, ?) "
+            "ORDER BY trigger_time, id LIMIT ?",
+            (format_db_datetime(cutoff), format_db_datetime(after[0]) if after[0] else '', after[1], limit)
+        )
+        return [self._reminder(row) for row in rows]
+
+    def add_reminder(self, user_id: int, text: str, trigger_time: datetime, chat_id: int = None) -> str:
+        reminder_id = str(uuid.uuid4())
+        self._execute("INSERT INTO reminders (id, user_id, text, trigger_time, chat_id) VALUES (?, ?, ?, ?, ?)",
+                      (reminder_id, user_id, text, format_db_datetime(trigger_time), chat_id or user_id))
+        return reminder_id
+
+    def delete_reminders(self, reminder_ids: list) -> None:
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        c.executemany("DELETE FROM reminders WHERE id=?", [(reminder_id,) for reminder_id in reminder_ids])
+        conn.commit()
+        conn.close()
+
+    def claim_reminder(self, reminder_id: str, owner: str, until: datetime, now: datetime) -> bool:
+        return self._execute_one(
+            "UPDATE reminders SET claimed_by=?, claimed_until=? "
+            "WHERE id=? AND (claimed_by IS NULL OR claimed_by=? OR claimed_until < ?)",
+            (owner, format_db_datetime(until), reminder_id, owner, format_db_datetime(now))
+        )
+
+    def complete_reminder(self, reminder_id: str, owner: str) -> bool:
+        return self._execute_one("DELETE FROM reminders WHERE id=? AND claimed_by=?", (reminder_id, owner))
+
+    def release_reminders(self, owner: str) -> int:
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        c.execute("UPDATE reminders SET claimed_by=NULL, claimed_until=NULL WHERE claimed_by=?", (owner,))
+        conn.commit()
+        conn.close()
+        return c.rowcount
+
+    def acquire_lease(self, name: str, owner: str, expires: datetime, now: datetime) -> tuple:
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, expires=excluded.expires, "
+            "successor=CASE WHEN leases.owner=excluded.owner THEN leases.successor END "
+            "WHERE leases.owner IS NULL OR leases.owner=excluded.owner OR leases.expires < ? "
+            "RETURNING successor",
+            (name, owner, format_db_datetime(expires), format_db_datetime(now))
+        )
+        row = c.fetchone()
+        conn.commit()
+        conn.close()
+        return row is not None, row[0] if row else None
+
+    def request_handoff(self, name: str, successor: str) -> None:
+        self._execute("UPDATE leases SET successor=? WHERE name=?", (successor, name))
+
+    def release_lease(self, name: str, owner: str) -> None:
+        self._execute("UPDATE leases SET owner=NULL, expires=NULL WHERE name=? AND owner=?", (name, owner))
+
+
+class MemoryStorage(Storage):
+    def __init__(self):
+        self.tasks = {}
+        self.expenses = {}
+        self.notes = {}
+        self.attachments = {}
+        self.reminders = {}
+        self.claims = {}
+        self.leases = {}
+        self.budgets = {}
+        self.budget_totals = {}
+        self.settings = {}
+        self.watermarks = {}
+        self._ids = count(1)
+
+    def get_tasks(self, chat_id: int) -> list:
+        tasks = [t for t in self.tasks.values() if t.chat_id == chat_id and not t.completed]
+        return sorted(tasks, key=lambda t: (t.due is not None, t.due or t.created))
+
+    def add_task(self, user_id: int, task: str, priority: int, due: datetime = None, chat_id: int = None) -> int:
+        task_id = next(self._ids)
+        self.tasks[task_id] = Task(task_id, user_id, task, priority, datetime.now(TIMEZONE), due, False,
+                                   chat_id or user_id)
+        return task_id
+
+    def _own(self, items: dict, user_id: int, item_id: int):
+        item = items.get(item_id)
+        return item if item is not None and item.user_id == user_id else None
+
+    def _chat_task(self, chat_id: int, task_id: int):
+        task = self.tasks.get(task_id)
+        return task if task is not None and task.chat_id == chat_id else None
+
+    def complete_task(self, chat_id: int, task_id: int) -> bool:
+        task = self._chat_task(chat_id, task_id)
+        if task is None:
+            return False
+        self.tasks[task_id] = task._replace(completed=True)
+        return True
+
+    def update_task(self, chat_id: int, task_id: int, task: str) -> bool:
+        row = self._chat_task(chat_id, task_id)
+        if row is None:
+            return False
+        self.tasks[task_id] = row._replace(task=task)
+        return True
+
+    def delete_task(self, chat_id: int, task_id: int) -> bool:
+        if self._chat_task(chat_id, task_id) is None:
+            return False
+        del self.tasks[task_id]
+        return True
+
+    def get_expenses(self, user_id: int, limit: int = 10, offset: int = 0) -> list:
+        expenses = [e for e in reversed(self.expenses.values()) if e.user_id == user_id]
+        return expenses[offset:offset + limit]
+
+    def get_expense_columns(self, user_id: int = None, start: datetime = None, end: datetime = None) -> ExpenseColumns:
+        expenses = sorted(
+            (e for e in self.expenses.values()
+             if (user_id is None or e.user_id == user_id) and (start is None or e.created >= start)
+             and (end is None or e.created < end)),
+            key=lambda e: e.created
+        )
+        data = np.fromiter(((e.amount, local_seconds(e.created), e.category, e.currency or DEFAULT_CURRENCY)
+                            for e in expenses), dtype=EXPENSE_COLUMNS_DTYPE, count=len(expenses))
+        return expense_columns(data)
+
+    def _budget_spent(self, user_id: int, key: str, period: str, base: str) -> float:
+        return exchange_rates.total(((total, currency) for (uid, category, p, currency), total
+                                     in self.budget_totals.items() if (uid, category, p) == (user_id, key, period)),
+                                    base)
+
+    def add_expense(self, user_id: int, amount: float, category: str, currency: str = None) -> tuple:
+        now = datetime.now(TIMEZONE)
+        expense_id = next(self._ids)
+        self.expenses[expense_id] = Expense(expense_id, user_id, amount, category, now, currency)
+
+        key = (user_id, budget_category(category))
+        period_key = key + (budget_period(now), currency or DEFAULT_CURRENCY)
+        self.budget_totals[period_key] = self.budget_totals.get(period_key, 0.0) + amount
+        if key not in self.budgets:
+            return expense_id, []
+        base = self.get_base_currency(user_id)
+        total = self._budget_spent(user_id, key[1], budget_period(now), base)
+        previous = total - (exchange_rates.convert(amount, currency, base) or 0.0)
+        return expense_id, crossed_thresholds(category, self.budgets[key], previous, total)
+
+    def get_base_currency(self, user_id: int) -> str:
+        return self.settings.get(user_id, DEFAULT_CURRENCY)
+
+    def set_base_currency(self, user_id: int, currency: str) -> None:
+        self.settings[user_id] = currency
+
+    def set_budget(self, user_id: int, category: str, monthly_limit: float) -> None:
+        key = (user_id, budget_category(category))
+        if monthly_limit <= 0:
+            self.budgets.pop(key, None)
+        else:
+            self.budgets[key] = monthly_limit
+
+    def get_budgets(self, user_id: int) -> list:
+        period = budget_period(datetime.now(TIMEZONE))
+        base = self.get_base_currency(user_id)
+        return [Budget(category, limit, self._budget_spent(user_id, category, period, base))
+                for (uid, category), limit in sorted(self.budgets.items()) if uid == user_id]
+
+    def iter_digest_rows(self, day_start: datetime, now: datetime):
+        day_end = day_start + timedelta(days=1)
+        yesterday = day_start - timedelta(days=1)
+        rows = [(t.chat_id, 0, t.task, t.due) for t in self.tasks.values()
+                if not t.completed and t.due and day_start <= t.due < day_end]
+        rows += [(r.chat_id, 1, r.text, r.trigger_time) for r in self.reminders.values()
+                 if now <= r.trigger_time < now + timedelta(days=1)]
+        totals = {}
+        for e in self.expenses.values():
+            if yesterday <= e.created < day_start:
+                key = (e.user_id, e.category, e.currency or DEFAULT_CURRENCY)
+                amount, number = totals.get(key, (0.0, 0))
+                totals[key] = (amount + e.amount, number + 1)
+        rows += [(user_id, 2, category, amount, number, currency, self.get_base_currency(user_id))
+                 for (user_id, category, currency), (amount, number) in totals.items()]
+        return iter(sorted(rows, key=lambda row: (row[0], row[1], row[3] if row[1] < 2 else -row[3])))
+
+    def get_due_tasks(self, after: tuple, until: datetime, limit: int) -> list:
+        tasks = sorted(
+            (t for t in self.tasks.values() if not t.completed and t.due and after < (t.due, t.id) and t.due <= until),
+            key=lambda t: (t.due, t.id)
+        )
+        return tasks[:limit]
+
+    def get_watermark(self, name: str) -> tuple:
+        return self.watermarks.get(name, (None, 0))
+
+    def set_watermark(self, name: str, watermark: datetime, last_id: int) -> None:
+        self.watermarks[name] = (watermark, last_id)
+
+    def _change_expense(self, user_id: int, expense_id: int, amount: Optional[float]) -> bool:
+        expense = self._own(self.expenses, user_id, expense_id)
+        if expense is None:
+            return False
+        if amount is None:
+            del self.expenses[expense_id]
+        else:
+            self.expenses[expense_id] = expense._replace(amount=amount)
+        key = (user_id, budget_category(expense.category), budget_period(expense.created),
+               expense.currency or DEFAULT_CURRENCY)
+        if key in self.budget_totals:
+            self.budget_totals[key] += (amount or 0) - expense.amount
+        return True
+
+    def update_expense(self, user_id: int, expense_id: int, amount: float) -> bool:
+        return self._change_expense(user_id, expense_id, amount)
+
+    def delete_expense(self, user_id: int, expense_id: int) -> bool:
+        return self._change_expense(user_id, expense_id, None)
+
+    def get_notes(self, user_id: int, limit: int = 10, offset: int = 0) -> list:
+        notes = [n for n in reversed(self.notes.values()) if n.user_id == user_id]
+        return notes[offset:offset + limit]
+
+    def get_note(self, user_id: int, note_id: int) -> Optional[Note]:
+        return self._own(self.notes, user_id, note_id)
+
+    def add_note(self, user_id: int, text: str, tags: str = None, attachment: Attachment = None) -> int:
+        note_id = next(self._ids)
+        self.notes[note_id] = Note(note_id, user_id, text, tags, datetime.now(TIMEZONE), attachment)
+        return note_id
+
+    def update_note(self, user_id: int, note_id: int, text: str) -> bool:
+        note = self._own(self.notes, user_id, note_id)
+        if note is None:
+            return False
+        self.notes[note_id] = note._replace(text=text)
+        return True
+
+    def delete_note(self, user_id: int, note_id: int) -> bool:
+        if self._own(self.notes, user_id, note_id) is None:
+            return False
+        del self.notes[note_id]
+        return True
+
+    def get_attachment_hash(self, file_unique_id: str) -> Optional[str]:
+        return self.attachments.get(file_unique_id)
+
+    def add_attachment(self, file_unique_id: str, file_hash: str, size: int) -> None:
+        self.attachments[file_unique_id] = file_hash
+
+    def get_attachment_hashes(self) -> set:
+        return {n.attachment.file_hash for n in self.notes.values() if n.attachment is not None}
+
+    def get_reminders(self, chat_id: int) -> list:
+        now = datetime.now(TIMEZONE)
+        reminders = [r for r in self.reminders.values() if r.chat_id == chat_id and r.trigger_time > now]
+        return sorted(reminders, key=lambda r: r.trigger_time)
+
+    def get_upcoming_reminders(self, after: datetime) -> list:
+        return [r for r in self.reminders.values() if r.trigger_time > after]
+
+    def get_overdue_reminders(self, cutoff: datetime, after: tuple, limit: int) -> list:
+        reminders = sorted(
+            (r for r in self.reminders.values()
+             if r.trigger_time <= cutoff and (after[0] is None or (r.trigger_time, r.id) > after)),
+            key=lambda r: (r.trigger_time, r.id)
+        )
+        return reminders[:limit]
+
+    def add_reminder(self, user_id: int, text: str, trigger_time: datetime, chat_id: int = None) -> str:
+        reminder_id = str(uuid.uuid4())
+        self.reminders[reminder_id] = Reminder(reminder_id, user_id, text, trigger_time, chat_id or user_id)
+        return reminder_id
+
+    def delete_reminders(self, reminder_ids: list) -> None:
+        for reminder_id in reminder_ids:
+            self.reminders.pop(reminder_id, None)
+            self.claims.pop(reminder_id, None)
+
+    def claim_reminder(self, reminder_id: str, owner: str, until: datetime, now: datetime) -> bool:
+        claim = self.claims.get(reminder_id)
+        if reminder_id not in self.reminders or (claim is not None and claim[0] != owner and claim[1] >= now):
+            return False
+        self.claims[reminder_id] = (owner, until)
+        return True
+
+    def complete_reminder(self, reminder_id: str, owner: str) -> bool:
+        claim = self.claims.get(reminder_id)
+        if claim is None or claim[0] != owner:
+            return False
+        del self.claims[reminder_id]
+        return self.reminders.pop(reminder_id, None) is not None
+
+    def release_reminders(self, owner: str) -> int:
+        released = [reminder_id for reminder_id, (claimed_by, _) in self.claims.items() if claimed_by == owner]
+        for reminder_id in released:
+            del self.claims[reminder_id]
+        return len(released)
+
+    def acquire_lease(self, name: str, owner: str, expires: datetime, now: datetime) -> tuple:
+        lease = self.leases.get(name)
+        if lease is not None and lease['owner'] not in (None, owner) and lease['expires'] >= now:
+            return False, None
+        successor = lease['successor'] if lease is not None and lease['owner'] == owner else None
+        self.leases[name] = {'owner': owner, 'expires': expires, 'successor': successor}
+        return True, successor
+
+    def request_handoff(self, name: str, successor: str) -> None:
+        if name in self.leases:
+            self.leases[name]['successor'] = successor
+
+    def release_lease(self, name: str, owner: str) -> None:
+        lease = self.leases.get(name)
+        if lease is not None and lease['owner'] == owner:
+            lease['owner'] = lease['expires'] = None
+
+
+storage = SQLiteStorage(DB_NAME)
+
+
+class BlobStore:
+    """Content-addressed store for note attachments: root/ab/<sha256>.
+
+    Telegram gives every forward of a file the same file_unique_id, so a file
+    seen before is not downloaded again, and different uploads with identical
+    content share one blob. Reads go through an LRU cache bounded by total
+    bytes; blobs larger than max_cached_blob bypass it and are streamed from
+    disk. open() runs in worker threads, so the cache is guarded by a lock and
+    file reads happen outside it.
+    """
+
+    def __init__(self, root: str = ATTACHMENT_DIR, cache_bytes: int = ATTACHMENT_CACHE_BYTES,
+                 max_cached_blob: int = ATTACHMENT_CACHE_MAX_BLOB):
+        self.root = root
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+        self.max_cached_blob = max_cached_blob
+        self.stats = {'downloaded': 0, 'deduplicated': 0, 'hits': 0, 'misses': 0}
+
+    def path(self, file_hash: str) -> str:
+        return os.path.join(self.root, file_hash[:2], file_hash)
+
+    async def store(self, bot, file_id: str, file_unique_id: str) -> str:
+        file_hash = storage.get_attachment_hash(file_unique_id)
+        if file_hash is not None and os.path.exists(self.path(file_hash)):
+            self.stats['deduplicated'] += 1
+            return file_hash
+
+        os.makedirs(self.root, exist_ok=True)
+        partial = os.path.join(self.root, f".{uuid.uuid4().hex}.part")
+        try:
+            telegram_file = await bot.get_file(file_id)
+            await telegram_file.download_to_drive(partial)
+            file_hash, size = await asyncio.to_thread(self._commit, partial)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        self.stats['downloaded'] += 1
+        storage.add_attachment(file_unique_id, file_hash, size)
+        return file_hash
+
+    def _commit(self, partial: str) -> tuple:
+        digest = hashlib.sha256()
+        size = 0
+        with open(partial, 'rb') as f:
+            for chunk in iter(lambda: f.read(ATTACHMENT_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                size += len(chunk)
+        file_hash = digest.hexdigest()
+        path = self.path(file_hash)
+        if os.path.exists(path):
+            with self.lock:
+                self.stats['deduplicated'] += 1
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(partial, path)
+        return file_hash, size
+
+    def open(self, file_hash: str):
+        """Return the blob as bytes from the cache, or an open file if it is too large to cache."""
+        with self.lock:
+            data = self.cache.get(file_hash)
+            if data is not None:
+                self.cache.move_to_end(file_hash)
+                self.stats['hits'] += 1
+                return data
+            self.stats['misses'] += 1
+        path = self.path(file_hash)
+        if os.path.getsize(path) > self.max_cached_blob:
+            return open(path, 'rb')
+        with open(path, 'rb') as f:
+            data = f.read()
+        with self.lock:
+            # another thread may have read the same blob meanwhile; count its bytes once
+            if file_hash not in self.cache:
+                self.cache[file_hash] = data
+                self.cached_bytes += len(data)
+                while self.cached_bytes > self.cache_bytes:
+                    _, evicted = self.cache.popitem(last=False)
+                    self.cached_bytes -= len(evicted)
+        return data
+
+    def collect_garbage(self, referenced: set) -> int:
+        cutoff = time.time() - ATTACHMENT_GC_GRACE.total_seconds()
+        removed = 0
+        for path in glob.glob(os.path.join(self.root, '??', '*')):
+            file_hash = os.path.basename(path)
+            if file_hash not in referenced and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        return removed
+
+
+blob_store = BlobStore()
 
 
 def get_main_menu():
@@ -88,6 +1733,411 @@ def get_back_button():
     return InlineKeyboardMarkup([[InlineKeyboardButton("Назад", callback_data='main_menu')]])
 
 
+class PageCache:
+    def __init__(self, ttl: float = LIST_CACHE_TTL, max_users: int = LIST_CACHE_MAX_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.lists = {}
+
+    def get(self, user_id: int, kind: str, page: int):
+        entry = self.lists.get((user_id, kind), {}).get(page)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def put(self, user_id: int, kind: str, page: int, value) -> None:
+        if len(self.lists) >= self.max_users and (user_id, kind) not in self.lists:
+            now = time.monotonic()
+            self.lists = {key: pages for key, pages in self.lists.items()
+                          if any(expires >= now for expires, _ in pages.values())}
+            if len(self.lists) >= self.max_users:
+                self.lists.clear()
+        self.lists.setdefault((user_id, kind), {})[page] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, user_id: int, kind: str, from_page: int = 0, only_page: bool = False) -> None:
+        pages = self.lists.get((user_id, kind))
+        if not pages:
+            return
+        for page in [p for p in pages if (p == from_page if only_page else p >= from_page)]:
+            del pages[page]
+
+
+page_cache = PageCache()
+
+LIST_VIEWS = {
+    't': ("📝 Ваши задачи:", "У вас нет активных задач."),
+    'e': ("💰 Расходы:", "У вас нет записанных расходов."),
+    'n': ("📌 Заметки:", "У вас нет сохраненных заметок."),
+}
+
+
+def format_task(task: Task) -> str:
+    due_date = task.due.strftime("%d.%m.%Y %H:%M") if task.due else "нет срока"
+    return f"{task.task}\nПриоритет: {task.priority}/5\nСрок: {due_date}"
+
+
+def format_expense(expense: Expense) -> str:
+    return f"{expense.amount} {currency_label(expense.currency)} - {expense.category}\nДата: {expense.created.strftime('%d.%m.%Y %H:%M')}"
+
+
+ATTACHMENT_LABELS = {'photo': "📎 Фото", 'document': "📎 Документ"}
+
+
+def format_note(note: Note) -> str:
+    tags = f"Теги: {note.tags}" if note.tags else ""
+    attachment = f"\n{ATTACHMENT_LABELS[note.attachment.kind]}" if note.attachment else ""
+    return f"{note.text}{attachment}\n{tags}\nДата: {note.created.strftime('%d.%m.%Y %H:%M')}"
+
+
+def message_length(text: str) -> int:
+    """Length as the Bot API counts it: UTF-16 code units, so emoji outside the BMP count as two."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def clip_units(text: str, limit: int) -> str:
+    """Longest prefix of text that fits in limit UTF-16 code units, never splitting a surrogate pair."""
+    return text.encode('utf-16-le')[:limit * 2].decode('utf-16-le', errors='ignore')
+
+
+def clip_message(text: str, limit: int) -> str:
+    if message_length(text) <= limit:
+        return text
+    return clip_units(text, limit - 1) + "…"
+
+
+def split_message(fragments, limit: int = MESSAGE_LIMIT):
+    """Pack pre-formatted fragments into messages of at most limit code units.
+
+    Each message is joined once. A fragment is only broken when it alone is over
+    the limit, and then preferably after a newline.
+    """
+    parts, length = [], 0
+    for fragment in fragments:
+        size = message_length(fragment)
+        if length and length + size > limit:
+            yield "".join(parts)
+            parts, length = [], 0
+        while size > limit:
+            head = clip_units(fragment, limit)
+            cut = head.rfind("\n") + 1 or len(head)
+            yield fragment[:cut]
+            fragment = fragment[cut:]
+            size = message_length(fragment)
+        parts.append(fragment)
+        length += size
+    if length:
+        yield "".join(parts)
+
+
+async def edit_message_chunks(query, chunks, reply_markup=None) -> None:
+    """Turn the menu message into the first chunk and send the rest after it; the markup goes on the last."""
+    chunks = list(chunks)
+    await query.edit_message_text(text=chunks[0], reply_markup=reply_markup if len(chunks) == 1 else None)
+    for number, chunk in enumerate(chunks[1:], start=2):
+        await query.message.reply_text(chunk, reply_markup=reply_markup if number == len(chunks) else None)
+
+
+def list_owner(kind: str, chat_id: int, user_id: int) -> int:
+    return chat_id if kind == 't' else user_id
+
+
+def load_list_page(kind: str, owner_id: int, page: int) -> tuple:
+    offset = page * LIST_PAGE_SIZE
+    if kind == 't':
+        tasks = storage.get_tasks(owner_id)
+        return [(t.id, format_task(t), False) for t in tasks[offset:offset + LIST_PAGE_SIZE]], \
+            len(tasks) > offset + LIST_PAGE_SIZE
+    if kind == 'e':
+        rows = [(e.id, format_expense(e), False)
+                for e in storage.get_expenses(owner_id, LIST_PAGE_SIZE + 1, offset)]
+    else:
+        rows = [(n.id, format_note(n), n.attachment is not None)
+                for n in storage.get_notes(owner_id, LIST_PAGE_SIZE + 1, offset)]
+    return rows[:LIST_PAGE_SIZE], len(rows) > LIST_PAGE_SIZE
+
+
+def render_list_page(kind: str, owner_id: int, page: int) -> tuple:
+    cached = page_cache.get(owner_id, kind, page)
+    if cached is not None:
+        return cached
+
+    title, empty_text = LIST_VIEWS[kind]
+    items, has_next = load_list_page(kind, owner_id, page)
+    while not items and page > 0:
+        page -= 1
+        items, has_next = load_list_page(kind, owner_id, page)
+    if not items:
+        return empty_text, get_main_menu()
+
+    fragments = [title + "\n\n"]
+    keyboard = []
+    for number, (item_id, item_text, has_attachment) in enumerate(items, start=page * LIST_PAGE_SIZE + 1):
+        fragments.append(f"{number}. {item_text}\n\n")
+        row = [InlineKeyboardButton(f"✏️ {number}", callback_data=f"{kind}:e:{item_id}:{page}"),
+               InlineKeyboardButton(f"🗑 {number}", callback_data=f"{kind}:d:{item_id}:{page}")]
+        if kind == 't':
+            row.insert(0, InlineKeyboardButton(f"✅ {number}", callback_data=f"{kind}:x:{item_id}:{page}"))
+        if has_attachment:
+            row.insert(0, InlineKeyboardButton(f"📎 {number}", callback_data=f"{kind}:a:{item_id}:{page}"))
+        keyboard.append(row)
+
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=f"{kind}:p:{page - 1}"))
+    if has_next:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f"{kind}:p:{page + 1}"))
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton("Назад", callback_data='main_menu')])
+
+    # the buttons belong to this page, so an oversized page is clipped item by item rather than split;
+    # short items keep their full text and the longest ones share what is left
+    if sum(map(message_length, fragments)) > MESSAGE_LIMIT:
+        remaining = MESSAGE_LIMIT - message_length(fragments[0])
+        order = sorted(range(1, len(fragments)), key=lambda index: message_length(fragments[index]))
+        for position, index in enumerate(order):
+            share = remaining // (len(order) - position)
+            fragments[index] = clip_message(fragments[index].rstrip("\n"), share - 2) + "\n\n"
+            remaining -= message_length(fragments[index])
+    result = ("".join(fragments), InlineKeyboardMarkup(keyboard))
+    page_cache.put(owner_id, kind, page, result)
+    return result
+
+
+async def show_list_page(query, kind: str, page: int) -> None:
+    owner_id = list_owner(kind, query.message.chat.id, query.from_user.id)
+    text, reply_markup = render_list_page(kind, owner_id, page)
+    try:
+        await query.edit_message_text(text=text, reply_markup=reply_markup)
+    except BadRequest as e:
+        # a repeated tap on a stale button re-renders the page it already shows
+        if "message is not modified" not in e.message.lower():
+            raise
+
+
+async def list_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+    kind, _, page = query.data.split(':')
+    await show_list_page(query, kind, int(page))
+
+
+async def item_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    kind, action, item_id, page = query.data.split(':')
+    owner_id = list_owner(kind, query.message.chat.id, query.from_user.id)
+    item_id, page = int(item_id), int(page)
+
+    if action == 'x':
+        changed = storage.complete_task(owner_id, item_id)
+    elif kind == 't':
+        changed = storage.delete_task(owner_id, item_id)
+    elif kind == 'e':
+        changed = storage.delete_expense(owner_id, item_id)
+    else:
+        changed = storage.delete_note(owner_id, item_id)
+
+    page_cache.invalidate(owner_id, kind, page)
+    search_index.invalidate(owner_id, kind)
+    await query.answer("✅ Готово" if changed else "Запись не найдена")
+    await show_list_page(query, kind, page)
+
+
+async def send_attachment(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    _, _, note_id, _ = query.data.split(':')
+    note = storage.get_note(query.from_user.id, int(note_id))
+    if note is None or note.attachment is None:
+        await query.answer("Запись не найдена")
+        return
+    await query.answer()
+
+    attachment = note.attachment
+    send = context.bot.send_photo if attachment.kind == 'photo' else context.bot.send_document
+    try:
+        await send(query.message.chat.id, attachment.file_id)
+        return
+    except BadRequest as e:
+        logger.info("file_id of note %s rejected, uploading from the blob store: %s", note.id, e)
+    try:
+        content = await asyncio.to_thread(blob_store.open, attachment.file_hash)
+    except FileNotFoundError:
+        await context.bot.send_message(query.message.chat.id, "Файл больше недоступен.")
+        return
+    try:
+        await send(query.message.chat.id, content)
+    finally:
+        if not isinstance(content, bytes):
+            content.close()
+
+
+async def edit_item_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    kind, _, item_id, page = query.data.split(':')
+    context.user_data['edit_item'] = (kind, int(item_id), int(page))
+    prompt = "Введите новую сумму расхода:" if kind == 'e' else "Введите новый текст:"
+    await query.edit_message_text(text=prompt, reply_markup=get_back_button())
+    return EDIT_ITEM
+
+
+async def set_item_value(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    kind, item_id, page = context.user_data['edit_item']
+    owner_id = list_owner(kind, update.message.chat_id, update.message.from_user.id)
+    value = update.message.text
+
+    if kind == 'e':
+        try:
+            amount = parse_amount(value)
+        except ValueError:
+            await update.message.reply_text("Некорректная сумма! Введите положительное число:",
+                                            reply_markup=get_back_button())
+            return EDIT_ITEM
+        changed = storage.update_expense(owner_id, item_id, amount)
+    elif kind == 't':
+        changed = storage.update_task(owner_id, item_id, value)
+    else:
+        changed = storage.update_note(owner_id, item_id, value)
+
+    page_cache.invalidate(owner_id, kind, page, only_page=True)
+    search_index.invalidate(owner_id, kind)
+    await update.message.reply_text("✅ Изменения сохранены!" if changed else "Запись не найдена.",
+                                    reply_markup=get_main_menu())
+    return ConversationHandler.END
+
+
+class SearchIndex:
+    """Per-user prefix index over notes and private-chat tasks for inline mode.
+
+    The index is a sorted token list searched with bisect; it is built off the
+    event loop on first use and dropped whenever the user's items change.
+    Results are cached per (user_id, query) for a few seconds, and a newer
+    query from the same user cancels the search still in flight. The build it
+    was waiting on is shared and shielded, so it survives the cancellation and
+    the next keystroke awaits the same build instead of starting another one.
+    """
+
+    def __init__(self, max_users: int = INLINE_INDEX_MAX_USERS, ttl: float = INLINE_CACHE_TTL):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.indexes = OrderedDict()
+        self.versions = {}
+        self.results = {}
+        self.searches = {}
+        self.builds = {}
+        self.stats = {'searched': 0, 'cached': 0, 'cancelled': 0, 'built': 0}
+
+    @staticmethod
+    def tokens(text: str) -> set:
+        return set(SEARCH_TOKEN_RE.findall(text.lower()))
+
+    def build(self, user_id: int) -> tuple:
+        items = {}
+        for task in storage.get_tasks(user_id):
+            items[('t', task.id)] = (f"📝 {task.task}", task.task, format_task(task))
+        for note in storage.get_notes(user_id, INLINE_NOTES_LIMIT):
+            items[('n', note.id)] = (f"📌 {note.text}", f"{note.text} {note.tags or ''}", format_note(note))
+        entries = sorted((token, key) for key, (_, text, _) in items.items() for token in self.tokens(text))
+        return [token for token, _ in entries], [key for _, key in entries], items
+
+    def lookup(self, index: tuple, query: str, limit: int = INLINE_RESULTS_LIMIT) -> list:
+        tokens, keys, items = index
+        matched = None
+        for word in self.tokens(query):
+            start = bisect_left(tokens, word)
+            end = bisect_left(tokens, word + "\U0010ffff", start)
+            found = set(keys[start:end])
+            matched = found if matched is None else matched & found
+            if not matched:
+                return []
+        return [(key, items[key]) for key in items if matched is None or key in matched][:limit]
+
+    def invalidate(self, owner_id: int, kind: str) -> None:
+        if kind == 'e':
+            return
+        self.versions[owner_id] = self.versions.get(owner_id, 0) + 1
+        self.indexes.pop(owner_id, None)
+        self.results.pop(owner_id, None)
+
+    async def index(self, user_id: int) -> tuple:
+        index = self.indexes.get(user_id)
+        if index is not None:
+            self.indexes.move_to_end(user_id)
+            return index
+        version = self.versions.get(user_id, 0)
+        build = self.builds.get(user_id)
+        if build is None or build[0] != version:
+            build = self.builds[user_id] = (version, asyncio.ensure_future(self._build(user_id, version)))
+        return await asyncio.shield(build[1])
+
+    async def _build(self, user_id: int, version: int) -> tuple:
+        try:
+            index = await asyncio.to_thread(self.build, user_id)
+        finally:
+            if self.builds.get(user_id, (None,))[0] == version:
+                del self.builds[user_id]
+        self.stats['built'] += 1
+        if self.versions.get(user_id, 0) == version:
+            self.indexes[user_id] = index
+            while len(self.indexes) > self.max_users:
+                evicted, _ = self.indexes.popitem(last=False)
+                self.results.pop(evicted, None)
+        return index
+
+    async def _search(self, user_id: int, query: str) -> list:
+        index = await self.index(user_id)
+        results = [
+            InlineQueryResultArticle(
+                id=f"{kind}{item_id}",
+                title=title[:64],
+                description=text[:128],
+                input_message_content=InputTextMessageContent(clip_message(message, MESSAGE_LIMIT)),
+            )
+            for (kind, item_id), (title, text, message) in self.lookup(index, query)
+        ]
+        if user_id in self.indexes:
+            cached = self.results.setdefault(user_id, {})
+            now = time.monotonic()
+            if len(cached) >= INLINE_RESULTS_LIMIT:
+                for stale in [q for q, (expires, _) in cached.items() if expires < now]:
+                    del cached[stale]
+            cached[query] = (now + self.ttl, results)
+        return results
+
+    async def search(self, user_id: int, query: str) -> Optional[list]:
+        """Return inline results, or None if a newer query superseded this one."""
+        cached = self.results.get(user_id, {}).get(query)
+        if cached is not None and cached[0] >= time.monotonic():
+            self.stats['cached'] += 1
+            return cached[1]
+
+        previous = self.searches.get(user_id)
+        if previous is not None and not previous.done():
+            previous.cancel()
+            self.stats['cancelled'] += 1
+        search = self.searches[user_id] = asyncio.ensure_future(self._search(user_id, query))
+        try:
+            await asyncio.wait({search})
+        finally:
+            if self.searches.get(user_id) is search:
+                del self.searches[user_id]
+        if search.cancelled():
+            return None
+        self.stats['searched'] += 1
+        return search.result()
+
+
+search_index = SearchIndex()
+
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.inline_query
+    results = await search_index.search(query.from_user.id, query.query.strip())
+    if results is None:
+        return
+    await query.answer(results, cache_time=INLINE_CACHE_TTL, is_personal=True)
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     welcome_text = """
     👋 Привет! Я твой личный организатор.
@@ -106,28 +2156,22 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.callback_query.edit_message_text(welcome_text, reply_markup=get_main_menu())
 
 
-async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await update.message.reply_text('Действие отменено', reply_markup=get_main_menu())
-    return ConversationHandler.END
-
+async def handle_new_members(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    for member in update.message.new_chat_members:
+        if member.id == context.bot.id:
+            welcome_text = """
+            👋 Привет! Я организатор для этой группы.
 
+            Задачи и напоминания, созданные здесь, общие для всех участников.
+            Напишите /start, чтобы начать работу!
+            """
+            await update.message.reply_text(welcome_text)
 
-def get_tasks(user_id: int):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT * FROM tasks WHERE user_id=? AND completed=0 ORDER BY due", (user_id,))
-    tasks = c.fetchall()
-    conn.close()
-    return tasks
 
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    await update.message.reply_text('Действие отменено', reply_markup=get_main_menu())
+    return ConversationHandler.END
 
-def add_task(user_id: int, task: str, priority: int, due: datetime = None):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO tasks (user_id, task, priority, created, due, completed) VALUES (?, ?, ?, ?, ?, 0)",
-              (user_id, task, priority, datetime.now(), due))
-    conn.commit()
-    conn.close()
 
 
 async def tasks_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -148,21 +2192,7 @@ async def tasks_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
 async def list_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
-
-    user_id = query.from_user.id
-    tasks = get_tasks(user_id)
-
-    if not tasks:
-        await query.edit_message_text(text="У вас нет активных задач.", reply_markup=get_main_menu())
-        return
-
-    tasks_text = "📝 Ваши задачи:\n\n"
-    for task in tasks:
-        due_date = datetime.strptime(task[5], "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y %H:%M") if task[
-            5] else "нет срока"
-        tasks_text += f"• {task[2]}\nПриоритет: {task[3]}/5\nСрок: {due_date}\n\n"
-
-    await query.edit_message_text(text=tasks_text, reply_markup=get_back_button())
+    await show_list_page(query, 't', 0)
 
 
 async def add_task_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -179,13 +2209,15 @@ async def set_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 
 async def set_priority(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    if not update.message.text.isdigit() or not 1 <= int(update.message.text) <= 5:
+    try:
+        context.user_data['priority'] = parse_priority(update.message.text)
+    except ValueError:
         await update.message.reply_text("Некорректный приоритет! Введите число от 1 до 5:",
                                         reply_markup=get_back_button())
         return SET_PRIORITY
 
-    context.user_data['priority'] = int(update.message.text)
-    await update.message.reply_text("Введите срок выполнения (ДД.ММ.ГГГГ ЧЧ:ММ или 'нет'):",
+    await update.message.reply_text("Введите срок выполнения (ДД.ММ.ГГГГ ЧЧ:ММ, 'завтра 9:00', "
+                                    "'через 2 часа', '+30m' или 'нет'):",
                                     reply_markup=get_back_button())
     return SET_DUE_DATE
 
@@ -194,42 +2226,28 @@ async def set_due_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     due_date = None
     if update.message.text.lower() != 'нет':
         try:
-            due_date = datetime.strptime(update.message.text, "%d.%m.%Y %H:%M")
-            due_date = TIMEZONE.localize(due_date)
+            due_date = parse_datetime_input(update.message.text)
         except ValueError:
             await update.message.reply_text("Некорректный формат даты! Используйте ДД.ММ.ГГГГ ЧЧ:ММ:",
                                             reply_markup=get_back_button())
             return SET_DUE_DATE
 
-    add_task(
+    task_id = storage.add_task(
         update.message.from_user.id,
         context.user_data['task'],
         context.user_data['priority'],
-        due_date
+        due_date,
+        update.message.chat_id
     )
+    event_log.record('task_created', user_id=update.message.from_user.id, chat_id=update.message.chat_id,
+                     task_id=task_id, priority=context.user_data['priority'], due=due_date)
+    page_cache.invalidate(update.message.chat_id, 't')
+    search_index.invalidate(update.message.chat_id, 't')
     await update.message.reply_text("✅ Задача добавлена!", reply_markup=get_main_menu())
     return ConversationHandler.END
 
 
 
-def get_expenses(user_id: int):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT * FROM expenses WHERE user_id=? ORDER BY created DESC LIMIT 10", (user_id,))
-    expenses = c.fetchall()
-    conn.close()
-    return expenses
-
-
-def add_expense(user_id: int, amount: float, category: str):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO expenses (user_id, amount, category, created) VALUES (?, ?, ?, ?)",
-              (user_id, amount, category, datetime.now()))
-    conn.commit()
-    conn.close()
-
-
 async def expenses_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
@@ -237,6 +2255,7 @@ async def expenses_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     keyboard = [
         [InlineKeyboardButton("Добавить расход", callback_data='add_expense'),
          InlineKeyboardButton("Последние расходы", callback_data='list_expenses')],
+        [InlineKeyboardButton("Бюджеты", callback_data='list_budgets')],
         [InlineKeyboardButton("Назад", callback_data='main_menu')]
     ]
     await query.edit_message_text(
@@ -248,20 +2267,159 @@ async def expenses_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 async def list_expenses(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
+    await show_list_page(query, 'e', 0)
+
+
+def format_budgets(budgets: list, base: str) -> str:
+    if not budgets:
+        return "У вас нет бюджетов."
+    label = currency_label(base)
+    return "📊 Бюджеты на месяц:\n\n" + "".join(
+        f"• {budget.category}: {budget.spent:.2f} из {budget.monthly_limit:.2f} {label} "
+        f"({budget.spent / budget.monthly_limit:.0%})\n"
+        for budget in budgets
+    )
+
+
+async def list_budgets(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
 
     user_id = query.from_user.id
-    expenses = get_expenses(user_id)
+    budgets_text = format_budgets(storage.get_budgets(user_id), storage.get_base_currency(user_id))
+    help_text = ("\n\nУстановить лимит: /budget <категория> <сумма>\nУдалить: /budget <категория> 0"
+                 "\nОсновная валюта: /currency <код>")
+    await edit_message_chunks(query, split_message(budgets_text.splitlines(keepends=True) + [help_text]),
+                              get_back_button())
+
+
+async def budget_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_id = update.message.from_user.id
+    if not context.args:
+        await update.message.reply_text(format_budgets(storage.get_budgets(user_id), storage.get_base_currency(user_id)),
+                                        reply_markup=get_main_menu())
+        return
+
+    try:
+        if len(context.args) < 2:
+            raise ValueError
+        monthly_limit = 0 if context.args[-1] == '0' else parse_amount(context.args[-1])
+    except ValueError:
+        await update.message.reply_text("Использование: /budget <категория> <сумма>")
+        return
+
+    category = " ".join(context.args[:-1])
+    storage.set_budget(user_id, category, monthly_limit)
+    if monthly_limit <= 0:
+        await update.message.reply_text(f"✅ Бюджет на '{category}' удален.", reply_markup=get_main_menu())
+    else:
+        await update.message.reply_text(
+            f"✅ Бюджет на '{category}': {monthly_limit:.2f} {currency_label(storage.get_base_currency(user_id))} "
+            f"в месяц.",
+            reply_markup=get_main_menu()
+        )
+
+
+async def currency_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_id = update.message.from_user.id
+    known = sorted(exchange_rates.current())
+    if not context.args:
+        await update.message.reply_text(
+            f"Основная валюта: {storage.get_base_currency(user_id)}\n"
+            f"Доступные валюты: {', '.join(known)}\n\nИзменить: /currency <код>",
+            reply_markup=get_main_menu()
+        )
+        return
+
+    currency = context.args[0]
+    currency = CURRENCY_ALIASES.get(currency.lower(), currency.upper())
+    if currency not in known:
+        await update.message.reply_text(f"Нет курса для валюты '{context.args[0]}'. Доступные: {', '.join(known)}")
+        return
+    storage.set_base_currency(user_id, currency)
+    page_cache.invalidate(user_id, 'e')
+    await update.message.reply_text(
+        f"✅ Основная валюта: {currency}. Итоги и бюджеты теперь считаются в ней; лимиты бюджетов не пересчитываются.",
+        reply_markup=get_main_menu()
+    )
+
+
+def daily_totals(columns: ExpenseColumns, first_day: int, last_day: int):
+    start, end = np.searchsorted(columns.created, (first_day * 86400, (last_day + 1) * 86400))
+    days = columns.created[start:end] // 86400 - first_day
+    return np.bincount(days, weights=columns.amount[start:end], minlength=last_day - first_day + 1)
+
+
+def moving_average(values, window: int):
+    if len(values) < window:
+        return np.zeros(0)
+    sums = np.cumsum(values)
+    sums[window:] = sums[window:] - sums[:-window]
+    return sums[window - 1:] / window
+
+
+def category_shares(columns: ExpenseColumns) -> list:
+    totals = np.bincount(columns.category, weights=columns.amount, minlength=len(columns.categories))
+    total = totals.sum()
+    return [(columns.categories[code], totals[code], totals[code] / total)
+            for code in np.argsort(totals)[::-1] if totals[code] > 0]
+
 
-    if not expenses:
-        await query.edit_message_text(text="У вас нет записанных расходов.", reply_markup=get_main_menu())
+def format_analytics(columns: ExpenseColumns, days: int, start: datetime, now: datetime) -> str:
+    totals = daily_totals(columns, local_seconds(start) // 86400, local_seconds(now) // 86400)
+    p50, p90, p99 = np.percentile(columns.amount, ANALYTICS_PERCENTILES)
+    average = moving_average(totals, ANALYTICS_WINDOW)
+    label = currency_label(columns.currencies[0])
+    lines = [
+        f"📊 Расходы за {days} дн.: {columns.amount.sum():.2f} {label} ({len(columns.amount)} записей)",
+        f"Медиана: {p50:.2f}, p90: {p90:.2f}, p99: {p99:.2f} {label}",
+    ]
+    if len(average):
+        lines.append(f"В среднем за последние {ANALYTICS_WINDOW} дн.: {average[-1]:.2f} {label} в день "
+                     f"(максимум {average.max():.2f})")
+    lines.append("\nПо категориям:")
+    for category, total, share in category_shares(columns)[:ANALYTICS_TOP_CATEGORIES]:
+        lines.append(f"{category}: {share:.1%} ({total:.2f} {label})")
+    return "\n".join(lines)
+
+
+async def analytics_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if np is None:
+        await update.message.reply_text("Аналитика недоступна: не установлен NumPy.")
+        return
+    try:
+        days = int(context.args[0]) if context.args else ANALYTICS_DEFAULT_DAYS
+        if days <= 0:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text("Использование: /analytics [дней]")
         return
 
-    expenses_text = "💰 Последние расходы:\n\n"
-    for expense in expenses:
-        date = datetime.strptime(expense[4], "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y %H:%M")
-        expenses_text += f"• {expense[2]} руб. - {expense[3]}\nДата: {date}\n\n"
+    user_id = update.message.from_user.id
+    now = datetime.now(TIMEZONE)
+    start = now - timedelta(days=days)
+    columns = await asyncio.to_thread(storage.get_expense_columns, user_id, start)
+    columns = convert_columns(columns, storage.get_base_currency(user_id))
+    if not len(columns.amount):
+        await update.message.reply_text(f"Нет расходов за последние {days} дн.", reply_markup=get_main_menu())
+        return
+    await update.message.reply_text(format_analytics(columns, days, start, now), reply_markup=get_main_menu())
 
-    await query.edit_message_text(text=expenses_text, reply_markup=get_back_button())
+
+async def export_expenses_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if np is None:
+        await update.message.reply_text("Экспорт недоступен: не установлен NumPy.")
+        return
+    columns = await asyncio.to_thread(storage.get_expense_columns, update.message.from_user.id)
+    if not len(columns.amount):
+        await update.message.reply_text("У вас нет записанных расходов.", reply_markup=get_main_menu())
+        return
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, amount=columns.amount, created=columns.created, category=columns.category,
+                        categories=np.array(columns.categories), currency=columns.currency,
+                        currencies=np.array(columns.currencies))
+    await update.message.reply_document(buffer.getvalue(), filename="expenses.npz",
+                                        caption=f"Расходов: {len(columns.amount)}")
 
 
 async def add_expense_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -273,10 +2431,15 @@ async def add_expense_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def set_expense_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        amount = float(update.message.text.replace(',', '.'))
-        if amount <= 0:
-            raise ValueError
+        amount, currency = parse_money(update.message.text)
+        if currency is not None and currency not in exchange_rates.current():
+            await update.message.reply_text(
+                f"Нет курса для валюты {currency}. Доступные: {', '.join(sorted(exchange_rates.current()))}",
+                reply_markup=get_back_button()
+            )
+            return SET_EXPENSE_AMOUNT
         context.user_data['amount'] = amount
+        context.user_data['currency'] = currency or storage.get_base_currency(update.message.from_user.id)
         await update.message.reply_text("Введите категорию расхода (например: 'Еда', 'Транспорт'):",
                                         reply_markup=get_back_button())
         return SET_EXPENSE_CATEGORY
@@ -288,31 +2451,28 @@ async def set_expense_amount(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 async def set_expense_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     category = update.message.text
-    add_expense(update.message.from_user.id, context.user_data['amount'], category)
+    user_id = update.message.from_user.id
+    amount, currency = context.user_data['amount'], context.user_data.get('currency', DEFAULT_CURRENCY)
+    expense_id, alerts = storage.add_expense(user_id, amount, category, currency)
+    event_log.record('expense_created', user_id=user_id, expense_id=expense_id, amount=amount, currency=currency,
+                     category=category, alerts=[alert.threshold for alert in alerts])
+    page_cache.invalidate(user_id, 'e')
     await update.message.reply_text(
-        f"✅ Расход {context.user_data['amount']} руб. на '{category}' добавлен!",
+        f"✅ Расход {amount} {currency_label(currency)} на '{category}' добавлен!",
         reply_markup=get_main_menu()
     )
-    return ConversationHandler.END
-
-
-
-def get_notes(user_id: int):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT * FROM notes WHERE user_id=? ORDER BY created DESC LIMIT 10", (user_id,))
-    notes = c.fetchall()
-    conn.close()
-    return notes
 
+    sender = context.bot_data['sender']
+    label = currency_label(storage.get_base_currency(user_id)) if alerts else None
+    for alert in alerts:
+        if alert.threshold >= 1:
+            text = f"⚠️ Бюджет на '{alert.category}' превышен: "
+        else:
+            text = f"⚠️ Израсходовано {alert.threshold:.0%} бюджета на '{alert.category}': "
+        sender.enqueue(context.application, update.message.chat_id,
+                       text + f"{alert.spent:.2f} из {alert.monthly_limit:.2f} {label}")
+    return ConversationHandler.END
 
-def add_note(user_id: int, text: str, tags: str = None):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO notes (user_id, text, tags, created) VALUES (?, ?, ?, ?)",
-              (user_id, text, tags, datetime.now()))
-    conn.commit()
-    conn.close()
 
 
 async def notes_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -333,65 +2493,61 @@ async def notes_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
 async def list_notes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
-
-    user_id = query.from_user.id
-    notes = get_notes(user_id)
-
-    if not notes:
-        await query.edit_message_text(text="У вас нет сохраненных заметок.", reply_markup=get_main_menu())
-        return
-
-    notes_text = "📌 Последние заметки:\n\n"
-    for note in notes:
-        date = datetime.strptime(note[4], "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y %H:%M")
-        tags = f"Теги: {note[3]}" if note[3] else ""
-        notes_text += f"• {note[2]}\n{tags}\nДата: {date}\n\n"
-
-    await query.edit_message_text(text=notes_text, reply_markup=get_back_button())
+    await show_list_page(query, 'n', 0)
 
 
 async def add_note_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    await query.edit_message_text(text="Введите текст заметки:", reply_markup=get_back_button())
+    await query.edit_message_text(text="Введите текст заметки или отправьте фото/документ:",
+                                  reply_markup=get_back_button())
     return SET_NOTE_TEXT
 
 
 async def set_note_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data['note_text'] = update.message.text
+    context.user_data.pop('note_attachment', None)
     await update.message.reply_text("Введите теги через запятую (или 'нет'):", reply_markup=get_back_button())
     return SET_NOTE_TAGS
 
 
+async def set_note_attachment(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    message = update.message
+    if message.photo:
+        media, kind, default_text = message.photo[-1], 'photo', "Фото"
+    else:
+        media, kind, default_text = message.document, 'document', message.document.file_name or "Документ"
+    if media.file_size and media.file_size > ATTACHMENT_MAX_BYTES:
+        await message.reply_text("Файл слишком большой (максимум 20 МБ). Отправьте другой файл или текст:",
+                                 reply_markup=get_back_button())
+        return SET_NOTE_TEXT
+
+    try:
+        file_hash = await blob_store.store(context.bot, media.file_id, media.file_unique_id)
+    except (NetworkError, OSError) as e:
+        logger.warning("Could not store attachment %s: %s", media.file_unique_id, e)
+        await message.reply_text("Не удалось сохранить файл, попробуйте еще раз:", reply_markup=get_back_button())
+        return SET_NOTE_TEXT
+
+    context.user_data['note_text'] = message.caption or default_text
+    context.user_data['note_attachment'] = Attachment(media.file_id, file_hash, kind)
+    await message.reply_text("Введите теги через запятую (или 'нет'):", reply_markup=get_back_button())
+    return SET_NOTE_TAGS
+
+
 async def set_note_tags(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     tags = None if update.message.text.lower() == 'нет' else update.message.text
-    add_note(update.message.from_user.id, context.user_data['note_text'], tags)
+    attachment = context.user_data.pop('note_attachment', None)
+    note_id = storage.add_note(update.message.from_user.id, context.user_data['note_text'], tags, attachment)
+    event_log.record('note_created', user_id=update.message.from_user.id, note_id=note_id, tagged=tags is not None,
+                     attachment=attachment.kind if attachment else None)
+    page_cache.invalidate(update.message.from_user.id, 'n')
+    search_index.invalidate(update.message.from_user.id, 'n')
     await update.message.reply_text("✅ Заметка добавлена!", reply_markup=get_main_menu())
     return ConversationHandler.END
 
 
 
-def get_reminders(user_id: int):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT * FROM reminders WHERE user_id=? AND trigger_time > datetime('now') ORDER BY trigger_time",
-              (user_id,))
-    reminders = c.fetchall()
-    conn.close()
-    return reminders
-
-
-def add_reminder(user_id: int, text: str, trigger_time: datetime):
-    reminder_id = str(uuid.uuid4())
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO reminders (id, user_id, text, trigger_time) VALUES (?, ?, ?, ?)",
-              (reminder_id, user_id, text, trigger_time))
-    conn.commit()
-    conn.close()
-    return reminder_id
-
-
 async def reminders_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
@@ -411,19 +2567,16 @@ async def list_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     query = update.callback_query
     await query.answer()
 
-    user_id = query.from_user.id
-    reminders = get_reminders(user_id)
+    reminders = storage.get_reminders(query.message.chat.id)
 
     if not reminders:
         await query.edit_message_text(text="У вас нет активных напоминаний.", reply_markup=get_main_menu())
         return
 
-    reminders_text = "🔔 Активные напоминания:\n\n"
-    for reminder in reminders:
-        trigger_time = datetime.strptime(reminder[3], "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y %H:%M")
-        reminders_text += f"• {reminder[2]}\nВремя: {trigger_time}\n\n"
-
-    await query.edit_message_text(text=reminders_text, reply_markup=get_back_button())
+    fragments = (f"• {reminder.text}\nВремя: {reminder.trigger_time.strftime('%d.%m.%Y %H:%M')}\n\n"
+                 for reminder in reminders)
+    await edit_message_chunks(query, split_message(chain(["🔔 Активные напоминания:\n\n"], fragments)),
+                              get_back_button())
 
 
 async def add_reminder_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -435,33 +2588,35 @@ async def add_reminder_handler(update: Update, context: ContextTypes.DEFAULT_TYP
 
 async def set_reminder_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data['reminder_text'] = update.message.text
-    await update.message.reply_text("Введите дату и время напоминания (ДД.ММ.ГГГГ ЧЧ:ММ):",
+    await update.message.reply_text("Введите дату и время напоминания (ДД.ММ.ГГГГ ЧЧ:ММ, 'завтра 9:00', "
+                                    "'через 2 часа' или '+30m'):",
                                     reply_markup=get_back_button())
     return SET_REMINDER_TIME
 
 
 async def set_reminder_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        trigger_time = datetime.strptime(update.message.text, "%d.%m.%Y %H:%M")
-        trigger_time = TIMEZONE.localize(trigger_time)
+        trigger_time = parse_datetime_input(update.message.text)
 
-        if trigger_time <= datetime.now():
+        if trigger_time <= datetime.now(TIMEZONE):
             await update.message.reply_text("Время напоминания должно быть в будущем! Введите заново:",
                                             reply_markup=get_back_button())
             return SET_REMINDER_TIME
 
-        reminder_id = add_reminder(
+        reminder_id = storage.add_reminder(
             update.message.from_user.id,
             context.user_data['reminder_text'],
-            trigger_time
+            trigger_time,
+            update.message.chat_id
         )
+        event_log.record('reminder_scheduled', user_id=update.message.from_user.id,
+                         chat_id=update.message.chat_id, reminder_id=reminder_id, trigger_time=trigger_time)
 
-
-        delay = (trigger_time - datetime.now()).total_seconds()
+        delay = (trigger_time - datetime.now(TIMEZONE)).total_seconds()
         context.application.job_queue.run_once(
             send_reminder_callback,
             delay,
-            data={'user_id': update.message.from_user.id, 'text': context.user_data['reminder_text']},
+            data={'chat_id': update.message.chat_id, 'text': context.user_data['reminder_text']},
             name=reminder_id
         )
 
@@ -476,17 +2631,510 @@ async def set_reminder_time(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return SET_REMINDER_TIME
 
 
+async def deliver_reminder(sender: RateLimitedSender, reminder_id: str, chat_id: int, text: str) -> Optional[bool]:
+    """Send a reminder under this instance's claim and delete it under the same key.
+
+    Returns None without sending if the reminder is gone or claimed by another
+    instance. A crash between the send and the delete can still repeat the
+    message once the claim times out; nothing else can.
+    """
+    if lifecycle.draining:
+        return None
+    now = datetime.now(TIMEZONE)
+    if not storage.claim_reminder(reminder_id, lifecycle.instance_id, now + REMINDER_CLAIM_TIMEOUT, now):
+        return None
+    task = asyncio.current_task()
+    lifecycle.deliveries.add(task)
+    try:
+        delivered = await sender.send(chat_id, text)
+        storage.complete_reminder(reminder_id, lifecycle.instance_id)
+    finally:
+        lifecycle.deliveries.discard(task)
+    return delivered
+
+
 async def send_reminder_callback(context: ContextTypes.DEFAULT_TYPE):
     job = context.job
-    await context.bot.send_message(
-        chat_id=job.data['user_id'],
-        text=f"🔔 Напоминание: {job.data['text']}"
+    delivered = await deliver_reminder(context.bot_data['sender'], job.name, job.data['chat_id'],
+                                       f"🔔 Напоминание: {job.data['text']}")
+    if delivered is not None:
+        event_log.record('reminder_fired', chat_id=job.data['chat_id'], reminder_id=job.name, source='job',
+                         delivered=delivered)
+
+
+async def catch_up_missed_reminders(context: ContextTypes.DEFAULT_TYPE) -> None:
+    sender = context.bot_data['sender']
+    now = datetime.now(TIMEZONE)
+    oldest = now - MISSED_REMINDER_GRACE
+    started = time.monotonic()
+    delivered = expired = 0
+    after = (None, '')
+
+    while not lifecycle.draining:
+        reminders = storage.get_overdue_reminders(now - CATCH_UP_DELAY, after, CATCH_UP_BATCH_SIZE)
+        if not reminders:
+            break
+        if after[0] is not None and (reminders[0].trigger_time, reminders[0].id) <= after:
+            logger.error("Catch-up got reminder %s again after %s; stopping", reminders[0].id, after)
+            break
+        after = (reminders[-1].trigger_time, reminders[-1].id)
+
+        outdated = []
+        for reminder in reminders:
+            if reminder.trigger_time < oldest:
+                expired += 1
+                outdated.append(reminder.id)
+                event_log.record('reminder_expired', chat_id=reminder.chat_id, reminder_id=reminder.id,
+                                 trigger_time=reminder.trigger_time)
+                continue
+            try:
+                sent = await deliver_reminder(
+                    sender, reminder.id, reminder.chat_id,
+                    f"🔔 Пропущенное напоминание "
+                    f"({reminder.trigger_time.strftime('%d.%m.%Y %H:%M')}): {reminder.text}"
+                )
+            except NetworkError as e:
+                logger.warning("Catch-up delivery of reminder %s postponed: %s", reminder.id, e)
+                continue
+            if sent is None:
+                continue
+            delivered += 1
+            event_log.record('reminder_fired', chat_id=reminder.chat_id, reminder_id=reminder.id,
+                             source='catch_up', trigger_time=reminder.trigger_time, delivered=sent)
+        storage.delete_reminders(outdated)
+        # a batch claimed by another instance is skipped without awaiting anything
+        await asyncio.sleep(0)
+
+    elapsed = time.monotonic() - started
+    total = delivered + expired
+    if not total:
+        return
+    logger.info(
+        "Missed reminders catch-up: %d delivered, %d expired in %.2fs (%.1f reminders/s)",
+        delivered, expired, elapsed, total / elapsed if elapsed else 0.0
     )
+
+
+def get_db_stats():
+    conn = sqlite3.connect(DB_NAME)
+    c = conn.cursor()
+    page_size = c.execute("PRAGMA page_size").fetchone()[0]
+    page_count = c.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = c.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.close()
+
+    wal_name = DB_NAME + "-wal"
+    return {
+        'file_size': os.path.getsize(DB_NAME),
+        'wal_size': os.path.getsize(wal_name) if os.path.exists(wal_name) else 0,
+        'page_size': page_size,
+        'page_count': page_count,
+        'freelist_count': freelist_count,
+        'fragmentation': freelist_count / page_count if page_count else 0.0,
+    }
+
+
+def attach_archive(c):
+    c.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_NAME,))
+    for table, _, _ in RETENTION_POLICIES:
+        c.execute(f"CREATE TABLE IF NOT EXISTS archive.{table} AS SELECT * FROM main.{table} WHERE 0")
+        c.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS archive.idx_{table}_id ON {table} (id)")
+        archived = {row[1] for row in c.execute(f"PRAGMA archive.table_info({table})")}
+        for row in c.execute(f"PRAGMA main.table_info({table})").fetchall():
+            if row[1] not in archived:
+                c.execute(f"ALTER TABLE archive.{table} ADD COLUMN {row[1]} {row[2]}")
+
+
+async def archive_old_rows() -> dict:
     conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
-    c.execute("DELETE FROM reminders WHERE id=?", (job.name,))
+    attach_archive(c)
     conn.commit()
+
+    moved = {}
+    now = datetime.now(TIMEZONE)
+    for table, condition, retention in RETENTION_POLICIES:
+        columns = ", ".join(row[1] for row in c.execute(f"PRAGMA main.table_info({table})"))
+        cutoff = format_db_datetime(now - retention)
+        moved[table] = 0
+        while True:
+            c.execute(f"SELECT id FROM main.{table} WHERE {condition} ORDER BY id LIMIT ?",
+                      (cutoff, MAINTENANCE_BATCH_SIZE))
+            ids = [row[0] for row in c.fetchall()]
+            if not ids:
+                break
+            placeholders = ", ".join("?" * len(ids))
+            c.execute(f"INSERT OR IGNORE INTO archive.{table} ({columns}) "
+                      f"SELECT {columns} FROM main.{table} WHERE id IN ({placeholders})", ids)
+            c.execute(f"DELETE FROM main.{table} WHERE id IN ({placeholders})", ids)
+            conn.commit()
+            moved[table] += len(ids)
+            await asyncio.sleep(MAINTENANCE_PAUSE)
+
+    c.execute("DETACH DATABASE archive")
     conn.close()
+    return moved
+
+
+async def incremental_vacuum() -> int:
+    conn = sqlite3.connect(DB_NAME)
+    c = conn.cursor()
+    freed = 0
+    while True:
+        free_pages = c.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free_pages:
+            break
+        c.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP})").fetchall()
+        freed += min(free_pages, VACUUM_PAGES_PER_STEP)
+        await asyncio.sleep(MAINTENANCE_PAUSE)
+    conn.close()
+    return freed
+
+
+async def run_maintenance(context: ContextTypes.DEFAULT_TYPE) -> None:
+    started = time.monotonic()
+    moved = await archive_old_rows()
+    freed = await incremental_vacuum()
+    blobs = await asyncio.to_thread(blob_store.collect_garbage, storage.get_attachment_hashes())
+    stats = get_db_stats()
+    logger.info(
+        "DB maintenance finished in %.2fs: archived %s, freed %d pages, removed %d attachment blobs; "
+        "size %d bytes (WAL %d), %d pages, %.1f%% free",
+        time.monotonic() - started, moved, freed, blobs, stats['file_size'], stats['wal_size'],
+        stats['page_count'], stats['fragmentation'] * 100
+    )
+
+
+def analyze() -> None:
+    # analysis_limit samples each index instead of reading it whole, so the run stays short on a large db
+    conn = sqlite3.connect(DB_NAME)
+    conn.execute(f"PRAGMA analysis_limit={ANALYZE_ROW_LIMIT}")
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+
+async def analyze_db(context: ContextTypes.DEFAULT_TYPE) -> None:
+    started = time.monotonic()
+    await asyncio.to_thread(analyze)
+    logger.info("ANALYZE finished in %.2fs", time.monotonic() - started)
+
+
+async def db_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    stats = get_db_stats()
+    await update.message.reply_text(
+        f"📊 {DB_NAME}\n"
+        f"Размер: {stats['file_size'] / 1024:.1f} КБ (WAL {stats['wal_size'] / 1024:.1f} КБ)\n"
+        f"Страниц: {stats['page_count']} по {stats['page_size']} байт\n"
+        f"Свободных страниц: {stats['freelist_count']} ({stats['fragmentation']:.1%})"
+    )
+
+
+def backup_db() -> dict:
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    stamp = datetime.now(TIMEZONE).strftime("%Y%m%d-%H%M%S")
+    snapshot = os.path.join(BACKUP_DIR, f"organizer-{stamp}.db")
+    started = time.monotonic()
+
+    # one read transaction, so writers from other connections can neither restart nor tear the snapshot
+    conn = sqlite3.connect(DB_NAME)
+    conn.execute("VACUUM INTO ?", (snapshot,))
+    conn.close()
+    copied = time.monotonic()
+
+    with open(snapshot, 'rb') as raw, gzip.open(snapshot + '.gz', 'wb') as compressed:
+        shutil.copyfileobj(raw, compressed)
+    os.remove(snapshot)
+
+    for old in sorted(glob.glob(os.path.join(BACKUP_DIR, "organizer-*.db.gz")))[:-BACKUP_KEEP]:
+        os.remove(old)
+
+    return {
+        'path': snapshot + '.gz',
+        'size': os.path.getsize(snapshot + '.gz'),
+        'copy_time': copied - started,
+        'total_time': time.monotonic() - started,
+    }
+
+
+async def run_backup() -> dict:
+    result = await asyncio.to_thread(backup_db)
+    logger.info("Backup %s written (%d bytes): copy %.2fs, total %.2fs",
+                result['path'], result['size'], result['copy_time'], result['total_time'])
+    return result
+
+
+async def backup_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await run_backup()
+
+
+async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    await update.message.reply_text("⏳ Создаю резервную копию...")
+    result = await run_backup()
+    await update.message.reply_text(
+        f"✅ Резервная копия сохранена: {result['path']}\n"
+        f"Размер: {result['size'] / 1024:.1f} КБ\n"
+        f"Копирование: {result['copy_time']:.2f} с, всего: {result['total_time']:.2f} с"
+    )
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    processor = context.application.update_processor
+    stats = processor.stats
+    await update.message.reply_text(
+        f"📈 Обработка обновлений\n"
+        f"Принято: {stats['admitted']}\n"
+        f"Отброшено (лимит пользователя): {stats['shed_user']}\n"
+        f"Отброшено (перегрузка): {stats['shed_global']}\n"
+        f"Объединено повторов: {stats['coalesced']}\n"
+        f"В работе: {processor.current_concurrent_updates}/{processor.max_concurrent_updates}, "
+        f"в очереди: {processor.pending}\n\n"
+        f"🔎 Инлайн-поиск\n"
+        f"Поисков: {search_index.stats['searched']}, из кэша: {search_index.stats['cached']}, "
+        f"отменено: {search_index.stats['cancelled']}, индексов построено: {search_index.stats['built']}\n\n"
+        f"🗒 Журнал событий\n"
+        f"Записано: {event_log.written}, в буфере: {len(event_log.buffer)}, потеряно: {event_log.dropped}"
+    )
+
+
+async def sweep_due_tasks(context: ContextTypes.DEFAULT_TYPE) -> None:
+    sender = context.bot_data['sender']
+    now = datetime.now(TIMEZONE)
+    after = storage.get_watermark('due_tasks')
+    if after[0] is None:
+        storage.set_watermark('due_tasks', now, 0)
+        return
+
+    retries = context.bot_data.setdefault('due_task_retries', Counter())
+    notified = 0
+    while True:
+        tasks = storage.get_due_tasks(after, now, DUE_SWEEP_BATCH_SIZE)
+        if not tasks:
+            break
+        if (tasks[0].due, tasks[0].id) <= after:
+            logger.error("Due-date sweep got task %s again at watermark %s; stopping", tasks[0].id, after)
+            break
+        results = await asyncio.gather(*(
+            sender.send(task.chat_id, f"⏰ Наступил срок задачи: {task.task}\n"
+                                      f"Срок: {task.due.strftime('%d.%m.%Y %H:%M')}")
+            for task in tasks
+        ), return_exceptions=True)
+        # a timeout or dropped connection holds the watermark before that task, so the next sweep retries it
+        # (and resends the rest of its batch) up to DUE_SWEEP_MAX_RETRIES times; any other error is final
+        held = None
+        for index, (task, result) in enumerate(zip(tasks, results)):
+            if not isinstance(result, Exception):
+                continue
+            if (isinstance(result, NetworkError) and not isinstance(result, BadRequest)
+                    and retries[task.id] < DUE_SWEEP_MAX_RETRIES):
+                retries[task.id] += 1
+                logger.warning("Due-date notification for task %s postponed, attempt %d: %s",
+                               task.id, retries[task.id], result)
+                held = index if held is None else held
+            else:
+                logger.warning("Due-date notification for task %s not delivered: %s", task.id, result)
+        delivered = tasks if held is None else tasks[:held]
+        for task in delivered:
+            retries.pop(task.id, None)
+        if delivered:
+            after = (delivered[-1].due, delivered[-1].id)
+            storage.set_watermark('due_tasks', *after)
+            notified += len(delivered)
+        if held is not None:
+            break
+
+    if notified:
+        logger.info("Due-date sweep notified %d tasks", notified)
+
+
+def build_digests(rows):
+    for user_id, group in groupby(rows, key=lambda row: row[0]):
+        tasks, reminders, expenses, base = [], [], {}, DEFAULT_CURRENCY
+        for row in group:
+            if row[1] == 0:
+                tasks.append(f"• {row[2]} — {parse_db_datetime(row[3]).strftime('%H:%M')}")
+            elif row[1] == 1:
+                reminders.append(f"• {row[2]} — {parse_db_datetime(row[3]).strftime('%d.%m %H:%M')}")
+            else:
+                base = row[6]
+                amount = exchange_rates.convert(row[3], row[5], base)
+                if amount is None:
+                    logger.warning("No exchange rate for %s, left out of the digest for %s", row[5], user_id)
+                    continue
+                total, number = expenses.get(row[2], (0.0, 0))
+                expenses[row[2]] = (total + amount, number + row[4])
+
+        fragments = ["☀️ Доброе утро! Ваша сводка на сегодня:\n"]
+        if tasks:
+            fragments += ["\n📝 Задачи на сегодня:\n"] + [line + "\n" for line in tasks]
+        if reminders:
+            fragments += ["\n🔔 Напоминания на ближайшие сутки:\n"] + [line + "\n" for line in reminders]
+        if expenses:
+            label = currency_label(base)
+            fragments.append(f"\n💰 Расходы за вчера: {sum(e[0] for e in expenses.values()):.2f} {label}\n")
+            fragments += [f"• {category} — {amount:.2f} {label} ({number})\n"
+                          for category, (amount, number) in sorted(expenses.items(), key=lambda item: -item[1][0])]
+        yield user_id, list(split_message(fragments))
+
+
+async def send_daily_digest(context: ContextTypes.DEFAULT_TYPE) -> None:
+    sender = context.bot_data['sender']
+    now = datetime.now(TIMEZONE)
+    day_start = TIMEZONE.localize(datetime.combine(now.date(), dt_time()))
+    started = time.monotonic()
+    users = 0
+
+    for user_id, chunks in build_digests(storage.iter_digest_rows(day_start, now)):
+        try:
+            for chunk in chunks:
+                await sender.send(user_id, chunk)
+        except NetworkError as e:
+            logger.warning("Digest for %s not delivered: %s", user_id, e)
+        users += 1
+
+    elapsed = time.monotonic() - started
+    logger.info("Daily digest sent to %d users in %.2fs (%.1f users/s)",
+                users, elapsed, users / elapsed if elapsed else 0.0)
+
+
+class HandlerProfiler:
+    """Samples cProfile and tracemalloc over single handler calls.
+
+    Both tools see everything the loop thread runs while the handler awaits,
+    so a sample starts only when no other update is in flight and is
+    discarded if another one arrives before it ends. Jobs and background
+    sends can still interleave, so the per-handler numbers are close but
+    not exact.
+    """
+
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.samples = Counter()
+        self.discarded = 0
+        self.stats = {}
+        self.allocations = {}
+        self.in_flight = 0
+        self._active = False
+        self._overlapped = False
+
+    def wrap(self, callback):
+        name = callback.__name__
+
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            if self._active:
+                self._overlapped = True
+            if not self.sample_rate or self.in_flight or random.random() >= self.sample_rate:
+                self.in_flight += 1
+                try:
+                    return await callback(update, context)
+                finally:
+                    self.in_flight -= 1
+            return await self._profile(name, callback, update, context)
+
+        return wrapper
+
+    async def _profile(self, name: str, callback, update, context):
+        self.in_flight += 1
+        self._active = True
+        self._overlapped = False
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return await callback(update, context)
+        finally:
+            profile.disable()
+            after = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+            self._active = False
+            self.in_flight -= 1
+
+            if self._overlapped:
+                self.discarded += 1
+            else:
+                self.samples[name] += 1
+                if name in self.stats:
+                    self.stats[name].add(profile)
+                else:
+                    self.stats[name] = pstats.Stats(profile)
+                allocations = self.allocations.setdefault(name, Counter())
+                for stat in after.compare_to(before, 'lineno'):
+                    allocations[str(stat.traceback)] += stat.size_diff
+
+    def dump(self, directory: str = PROFILE_DIR) -> list:
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.now(TIMEZONE).strftime("%Y%m%d-%H%M%S")
+        paths = []
+        for name, stats in self.stats.items():
+            base = os.path.join(directory, f"{stamp}-{name}")
+            stats.dump_stats(base + ".prof")
+            with open(base + ".txt", 'w', encoding='utf-8') as report:
+                report.write(f"{name}: {self.samples[name]} samples\n\n")
+                pstats.Stats(base + ".prof", stream=report).sort_stats('cumulative').print_stats(30)
+                report.write("Top allocations (bytes):\n")
+                for line, size in self.allocations[name].most_common(PROFILE_TOP_ALLOCATIONS):
+                    report.write(f"{size:>12}  {line}\n")
+            paths.append(base + ".txt")
+        return paths
+
+    def reset(self) -> None:
+        self.samples.clear()
+        self.discarded = 0
+        self.stats.clear()
+        self.allocations.clear()
+
+
+profiler = HandlerProfiler()
+
+
+def instrument_handlers(handlers) -> None:
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            instrument_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                instrument_handlers(state_handlers)
+            instrument_handlers(handler.fallbacks)
+        else:
+            handler.callback = profiler.wrap(handler.callback)
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    action = context.args[0] if context.args else ''
+
+    if action == 'on':
+        try:
+            profiler.sample_rate = float(context.args[1]) if len(context.args) > 1 else 0.1
+        except ValueError:
+            await update.message.reply_text("Использование: /profile on [доля от 0 до 1]")
+            return
+        await update.message.reply_text(f"🔬 Профилирование включено для {profiler.sample_rate:.1%} обновлений.")
+    elif action == 'off':
+        profiler.sample_rate = 0
+        await update.message.reply_text("🔬 Профилирование выключено.")
+    elif action == 'dump':
+        paths = await asyncio.to_thread(profiler.dump)
+        profiler.reset()
+        await update.message.reply_text("🔬 Отчеты сохранены:\n" + "\n".join(paths) if paths else "Нет данных.")
+    else:
+        samples = ", ".join(f"{name}: {n}" for name, n in profiler.samples.most_common()) or "нет"
+        await update.message.reply_text(
+            f"🔬 Доля профилируемых обновлений: {profiler.sample_rate:.1%}\n"
+            f"Собрано: {samples}\n"
+            f"Отброшено из-за параллельных обновлений: {profiler.discarded}\n\n/profile on [доля] | off | dump"
+        )
 
 
 async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -497,10 +3145,50 @@ async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error(msg="Exception while handling an update:", exc_info=context.error)
+    event_log.record('error', error=type(context.error).__name__, message=str(context.error)[:200],
+                     update_id=update.update_id if isinstance(update, Update) else None,
+                     job=context.job.name if context.job else None)
 
 
-def main() -> None:
-    application = Application.builder().token(TOKEN).build()
+async def flush_event_log(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await event_log.flush()
+
+
+def schedule_reminders(application: Application) -> None:
+    now = datetime.now(TIMEZONE)
+    for reminder in storage.get_upcoming_reminders(now):
+        application.job_queue.run_once(
+            send_reminder_callback,
+            (reminder.trigger_time - now).total_seconds(),
+            data={'chat_id': reminder.chat_id, 'text': reminder.text},
+            name=reminder.id
+        )
+
+
+async def start_lifecycle(application: Application) -> None:
+    await lifecycle.acquire()
+    schedule_reminders(application)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, lifecycle.stop_signal, application)
+        except NotImplementedError:
+            pass
+
+
+async def close_event_log(application: Application) -> None:
+    batch = event_log.drain()
+    if batch:
+        event_log.write(batch)
+
+
+def build_application(request=None) -> Application:
+    builder = Application.builder().token(TOKEN).concurrent_updates(AdmissionUpdateProcessor()) \
+        .post_init(start_lifecycle).post_shutdown(close_event_log)
+    if request is not None:
+        builder = builder.request(request)
+    application = builder.build()
+    application.bot_data['sender'] = RateLimitedSender(application.bot)
 
 
     task_conv_handler = ConversationHandler(
@@ -527,13 +3215,23 @@ def main() -> None:
     note_conv_handler = ConversationHandler(
         entry_points=[CallbackQueryHandler(add_note_handler, pattern='^add_note$')],
         states={
-            SET_NOTE_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, set_note_text)],
+            SET_NOTE_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, set_note_text),
+                            MessageHandler(filters.PHOTO | filters.Document.ALL, set_note_attachment)],
             SET_NOTE_TAGS: [MessageHandler(filters.TEXT & ~filters.COMMAND, set_note_tags)]
         },
         fallbacks=[CommandHandler('cancel', cancel)]
     )
 
 
+    edit_conv_handler = ConversationHandler(
+        entry_points=[CallbackQueryHandler(edit_item_handler, pattern=r'^[ten]:e:\d+:\d+$')],
+        states={
+            EDIT_ITEM: [MessageHandler(filters.TEXT & ~filters.COMMAND, set_item_value)]
+        },
+        fallbacks=[CommandHandler('cancel', cancel)]
+    )
+
+
     reminder_conv_handler = ConversationHandler(
         entry_points=[CallbackQueryHandler(add_reminder_handler, pattern='^add_reminder$')],
         states={
@@ -545,6 +3243,16 @@ def main() -> None:
 
 
     application.add_handler(CommandHandler('start', start))
+    application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, handle_new_members))
+    application.add_handler(CommandHandler('dbstats', db_stats_command))
+    application.add_handler(CommandHandler('backup', backup_command))
+    application.add_handler(CommandHandler('stats', stats_command))
+    application.add_handler(CommandHandler('budget', budget_command))
+    application.add_handler(CommandHandler('currency', currency_command))
+    application.add_handler(CommandHandler('analytics', analytics_command))
+    application.add_handler(CommandHandler('export_expenses', export_expenses_command))
+    application.add_handler(CommandHandler('profile', profile_command))
+    application.add_handler(InlineQueryHandler(inline_query))
     application.add_handler(CallbackQueryHandler(tasks_menu, pattern='^tasks$'))
     application.add_handler(CallbackQueryHandler(expenses_menu, pattern='^expenses$'))
     application.add_handler(CallbackQueryHandler(notes_menu, pattern='^notes$'))
@@ -552,34 +3260,41 @@ def main() -> None:
     application.add_handler(CallbackQueryHandler(main_menu, pattern='^main_menu$'))
     application.add_handler(CallbackQueryHandler(list_tasks, pattern='^list_tasks$'))
     application.add_handler(CallbackQueryHandler(list_expenses, pattern='^list_expenses$'))
+    application.add_handler(CallbackQueryHandler(list_budgets, pattern='^list_budgets$'))
     application.add_handler(CallbackQueryHandler(list_notes, pattern='^list_notes$'))
     application.add_handler(CallbackQueryHandler(list_reminders, pattern='^list_reminders$'))
+    application.add_handler(CallbackQueryHandler(list_page, pattern=r'^[ten]:p:\d+$'))
+    application.add_handler(CallbackQueryHandler(item_action, pattern=r'^t:x:\d+:\d+$|^[ten]:d:\d+:\d+$'))
+    application.add_handler(CallbackQueryHandler(send_attachment, pattern=r'^n:a:\d+:\d+$'))
 
 
     application.add_handler(task_conv_handler)
     application.add_handler(expense_conv_handler)
     application.add_handler(note_conv_handler)
     application.add_handler(reminder_conv_handler)
+    application.add_handler(edit_conv_handler)
 
     application.add_error_handler(error_handler)
 
+    for handlers in application.handlers.values():
+        instrument_handlers(handlers)
 
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT * FROM reminders WHERE trigger_time > datetime('now')")
-    for reminder in c.fetchall():
-        trigger_time = datetime.strptime(reminder[3], "%Y-%m-%d %H:%M:%S")
-        if trigger_time > datetime.now():
-            delay = (trigger_time - datetime.now()).total_seconds()
-            application.job_queue.run_once(
-                send_reminder_callback,
-                delay,
-                data={'user_id': reminder[1], 'text': reminder[2]},
-                name=reminder[0]
-            )
-    conn.close()
 
-    application.run_polling()
+    application.job_queue.run_repeating(lifecycle.heartbeat, LEASE_RENEW_INTERVAL, name='scheduler_lease')
+    application.job_queue.run_repeating(catch_up_missed_reminders, CATCH_UP_INTERVAL, first=0,
+                                        name='catch_up_missed_reminders')
+    application.job_queue.run_repeating(run_maintenance, MAINTENANCE_INTERVAL, first=60, name='db_maintenance')
+    application.job_queue.run_repeating(analyze_db, ANALYZE_INTERVAL, first=300, name='db_analyze')
+    application.job_queue.run_repeating(backup_job, BACKUP_INTERVAL, first=600, name='db_backup')
+    application.job_queue.run_daily(send_daily_digest, DIGEST_TIME, name='daily_digest')
+    application.job_queue.run_repeating(sweep_due_tasks, DUE_SWEEP_INTERVAL, first=30, name='due_sweeper')
+    application.job_queue.run_repeating(flush_event_log, EVENT_FLUSH_INTERVAL, name='event_log_flush')
+    return application
+
+
+def main() -> None:
+    init_db()
+    build_application().run_polling(stop_signals=None)
 
 
 if __name__ == "__main__":